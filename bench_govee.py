@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import contextlib
+import functools
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from govee_codec import bad_frames, gv_rx_chk, gv_tx_chk
+from govee_logger import (
+    CheckerIndex,
+    Govee_H5174,
+    Govee_H5179,
+    ScanDutyCycle,
+    detection_callback,
+    model_classes,
+    now_minute,
+    scan_filter,
+)
+from govee_sim import SimAdvertisement, SimBackend, SimDevice
+
+# Micro and end-to-end benchmarks for the protocol and decode hot paths.
+#
+#   python bench_govee.py -o before.json
+#   python bench_govee.py --compare before.json
+#
+# Each result is an operations/second figure (best of --repeat runs), per
+# second of CPU time rather than wall time for benchmarks registered with
+# clock=time.process_time; with --compare the run fails if any benchmark
+# drops below --threshold times the baseline.
+
+benchmarks = {}
+
+
+def bench(name, unit="op", clock=time.perf_counter):
+    def register(fn):
+        benchmarks[name] = (fn, unit, clock)
+        return fn
+
+    return register
+
+
+def rate(setup, n, repeat, clock=time.perf_counter):
+    # best of `repeat` timings of n calls; setup() does any preparation
+    # outside the timed region and returns the loop to time, which may
+    # return how many units it actually did when that is not n
+    fn = setup()
+    best = None
+    for _ in range(repeat):
+        t0 = clock()
+        done = fn(n)
+        # process_time() can tick coarsely enough to read zero on a short run
+        r = (n if done is None else done) / max(clock() - t0, 1e-9)
+        if best is None or r > best:
+            best = r
+    return best
+
+
+@bench("gv_rx_chk")
+def bench_rx_chk():
+    frame = bytes.fromhex("AA0D312E30302E3032000000000000000000" + "0094")
+
+    def run(n):
+        for _ in range(n):
+            gv_rx_chk(frame)
+
+    return run
+
+
+@bench("gv_tx_chk")
+def bench_tx_chk():
+    def run(n):
+        for _ in range(n):
+            gv_tx_chk("AA0D")
+
+    return run
+
+
+@bench("bad_frames_1000", unit="frame")
+def bench_bad_frames():
+    frames = bytes.fromhex("AA0D312E30302E3032000000000000000000" + "0094") * 1000
+
+    def run(n):
+        # whole buffers, at least one
+        passes = max(1, n // 1000)
+        for _ in range(passes):
+            bad_frames(frames)
+        return passes * 1000
+
+    return run
+
+
+H5174_AD = SimAdvertisement(
+    local_name="GVH5174_6BE0",
+    manufacturer_data={1: b"\x01\x01\x02\xf7\xd6d", 76: b"\x02\x15INTELLI_ROCKS_HWPu\xf2\xff\xc2"},
+)
+H5179_AD = SimAdvertisement(
+    local_name="Govee_H5179_E0E2",
+    manufacturer_data={34817: b"\xec\x00\x01\x01\xea\x06\xd6\x15X"},
+)
+
+
+@bench("advertisement_h5174")
+def bench_ad_h5174():
+    d = Govee_H5174(SimDevice("A4:C1:38:86:6B:E0", "GVH5174_6BE0"), H5174_AD)
+
+    def run(n):
+        for _ in range(n):
+            d.advertisement(H5174_AD)
+
+    return run
+
+
+@bench("advertisement_h5179")
+def bench_ad_h5179():
+    d = Govee_H5179(SimDevice("E3:32:80:C1:E0:E2", "Govee_H5179_E0E2"), H5179_AD)
+
+    def run(n):
+        for _ in range(n):
+            d.advertisement(H5179_AD)
+
+    return run
+
+
+def address(prefix, i):
+    return f"{prefix}:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}"
+
+
+def detection_setup(count):
+    checkers = CheckerIndex([Govee_H5174, Govee_H5179], negative_cache=2 * count)
+    known = {}
+    q = asyncio.Queue()
+    noise = SimAdvertisement(manufacturer_data={76: b"\x10\x05\x01\x18"})
+    for i in range(count):
+        a = address("E3:32:80", i)
+        known[a] = Govee_H5179(SimDevice(a, "Govee_H5179_0000"), H5179_AD)
+        detection_callback(checkers, known, q, SimDevice(address("02:00:00", i), None), noise)
+    return checkers, known, q, noise
+
+
+def bench_detection(count):
+    # alternating known-device and cached non-Govee advertisements, with
+    # `count` of each already seen
+    def setup():
+        checkers, known, q, noise = detection_setup(count)
+        last = known[address("E3:32:80", count - 1)].device
+        other = SimDevice(address("02:00:00", count - 1), None)
+
+        def run(n):
+            pairs = max(1, n // 2)
+            for _ in range(pairs):
+                detection_callback(checkers, known, q, last, H5179_AD)
+                detection_callback(checkers, known, q, other, noise)
+            return pairs * 2
+
+        return run
+
+    return setup
+
+
+for count in (10, 1000, 10000):
+    bench(f"detection_callback_{count}")(bench_detection(count))
+
+
+def h5174_transfer(readings=10800):
+    sim = SimBackend(h5174=1, h5179=0)
+    probe = next(iter(sim.probes.values()))
+    return b"".join(probe.bulk_rows(readings - 1, 0, now_minute())), now_minute()
+
+
+def h5179_transfer(readings=10800):
+    sim = SimBackend(h5174=0, h5179=1)
+    probe = next(iter(sim.probes.values()))
+    now = now_minute()
+    return b"".join(probe.bulk_rows(now - readings + 1, now)), now
+
+
+@bench("decode_h5174_10800", unit="reading")
+def bench_decode_h5174():
+    buf, now = h5174_transfer()
+    d = Govee_H5174(SimDevice("A4:C1:38:86:6B:E0", "GVH5174_6BE0"), H5174_AD)
+
+    def run(n):
+        passes = max(1, n // 10800)
+        for _ in range(passes):
+            d.decode_rows(buf, now)
+        return passes * 10800
+
+    return run
+
+
+@bench("decode_h5179_10800", unit="reading")
+def bench_decode_h5179():
+    buf, now = h5179_transfer()
+    d = Govee_H5179(SimDevice("E3:32:80:C1:E0:E2", "Govee_H5179_E0E2"), H5179_AD)
+
+    def run(n):
+        passes = max(1, n // 10800)
+        for _ in range(passes):
+            d.decode_rows(buf, now)
+        return passes * 10800
+
+    return run
+
+
+@bench("do_download_sim", unit="reading")
+def bench_do_download():
+    # full H5174 and H5179 transfers through the simulated GATT client
+    sim = SimBackend(h5174=1, h5179=1)
+    devices = []
+    for probe in sim.probes.values():
+        cls = Govee_H5174 if probe.device.name.startswith("GVH5174_") else Govee_H5179
+        devices.append(cls(probe.device, probe.advertisement(), sim))
+
+    async def download(n):
+        total = 0
+        while total < n:
+            for d in devices:
+                total += len(await d.do_download())
+        return total
+
+    def run(n):
+        # whole transfers only, so usually more than n readings
+        return asyncio.run(download(n))
+
+    return run
+
+
+def scan_sim(filtered, duty=None):
+    # n advertisements on air from 2 probes among 200 other devices, through
+    # the simulated scanner and detection_callback, timed as CPU per
+    # advertisement delivered to the callback. With `filtered` the scanner
+    # drops what lacks the Govee service UUID, as the OS would; `duty` is
+    # (window, fast_interval, slow_interval) for a ScanDutyCycle, which
+    # leaves the loop idle between windows.
+    classes = model_classes(["H5174", "H5179"])
+    uuids = scan_filter(classes) if filtered else None
+
+    async def scan(n):
+        sim = SimBackend(h5174=1, h5179=1, others=200, ad_interval=0)
+        scanner = sim.scanner(uuids)
+        known = {}
+        scanner.register_detection_callback(
+            functools.partial(detection_callback, CheckerIndex(classes), known, asyncio.Queue(), backend=sim)
+        )
+        if duty is None:
+            await scanner.start()
+        else:
+            cycle = asyncio.create_task(ScanDutyCycle(scanner, known, *duty).run())
+        while sim.advertisements < n:
+            await asyncio.sleep(0 if duty is None else duty[0] / 10)
+        if duty is None:
+            await scanner.stop()
+        else:
+            cycle.cancel()
+            await asyncio.gather(cycle, return_exceptions=True)
+        return sim.delivered
+
+    def run(n):
+        return asyncio.run(scan(n))
+
+    return run
+
+
+@bench("scan_sim_unfiltered", unit="delivered", clock=time.process_time)
+def bench_scan_unfiltered():
+    return scan_sim(False)
+
+
+@bench("scan_sim_filtered", unit="delivered", clock=time.process_time)
+def bench_scan_filtered():
+    return scan_sim(True)
+
+
+@bench("scan_sim_duty_cycled", unit="delivered", clock=time.process_time)
+def bench_scan_duty_cycled():
+    # filtered and duty-cycled, as the daemon runs with --scan-window
+    return scan_sim(True, (0.01, 0.02, 0.05))
+
+
+# calls per timing run, chosen for roughly 0.1-1s each on a desktop
+SIZES = {
+    "gv_rx_chk": 100000,
+    "gv_tx_chk": 100000,
+    "bad_frames_1000": 1000000,
+    "advertisement_h5174": 100000,
+    "advertisement_h5179": 100000,
+    "detection_callback_10": 100000,
+    "detection_callback_1000": 100000,
+    "detection_callback_10000": 100000,
+    "decode_h5174_10800": 10800 * 20,
+    "decode_h5179_10800": 10800 * 20,
+    "do_download_sim": 40000,
+    "scan_sim_unfiltered": 100000,
+    "scan_sim_filtered": 100000,
+    "scan_sim_duty_cycled": 100000,
+}
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_all(names, repeat, scale):
+    results = {}
+    for name in names:
+        fn, unit, clock = benchmarks[name]
+        n = max(1, int(SIZES[name] * scale))
+        unit = f"{unit}/cpu-s" if clock is time.process_time else f"{unit}/s"
+        results[name] = {"rate": rate(fn, n, repeat, clock), "unit": unit, "n": n}
+        line = f"{name:28} {results[name]['rate']:14.0f} {unit}"
+        if clock is time.process_time and results[name]["rate"]:
+            # the inverse reads more naturally for CPU cost
+            results[name]["cpu_us"] = 1e6 / results[name]["rate"]
+            line += f" ({results[name]['cpu_us']:.1f} CPU us each)"
+        print(line, file=sys.stderr)
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    regressions = []
+    for name, r in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = r["rate"] / base["rate"]
+        flag = " REGRESSION" if ratio < threshold else ""
+        print(f"{name:28} {ratio:6.2f}x{flag}", file=sys.stderr)
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Govee logger benchmarks")
+    parser.add_argument("names", nargs="*", help=f"subset of: {', '.join(benchmarks)}")
+    parser.add_argument("-o", "--output", help="write JSON results here, default stdout")
+    parser.add_argument("--compare", help="baseline JSON from a previous run")
+    parser.add_argument("--threshold", type=float, default=0.8, help="minimum rate ratio vs baseline")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply iteration counts")
+    args = parser.parse_args(argv)
+
+    names = args.names or list(benchmarks)
+    # progress chatter goes to stderr so stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_all(names, args.repeat, args.scale)
+
+    out = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
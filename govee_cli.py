@@ -0,0 +1,393 @@
+import argparse
+import sys
+import time
+
+# Command line entry point:
+#
+#   python govee_cli.py scan --time 30
+#   python govee_cli.py download --daemon --sink sqlite:govee.db
+#   python govee_cli.py export --start=-1d --format line
+#   python govee_cli.py query A4:C1:38:86:6B:E0 --start 2022-01-01 --bucket 1440
+#   python govee_cli.py decode H5179 ec000101ea06d61558
+#   python govee_cli.py replay govee.journal --store govee_data
+#
+# Modules are imported by the command that needs them. export, query,
+# decode and replay only touch the store and codecs, so they never load asyncio or the
+# BLE stack.
+
+UNITS = {"m": 1, "h": 60, "d": 1440}
+
+
+def parse_minute(text):
+    # minute index, ISO date/time (local), or relative to now: -90m, -24h, -7d
+    if text is None:
+        return None
+    if text.isdigit():
+        return int(text)
+    if text.startswith("-") and text[-1] in UNITS and text[1:-1].isdigit():
+        return int(time.time() // 60) - int(text[1:-1]) * UNITS[text[-1]]
+    from datetime import datetime
+
+    return int(datetime.fromisoformat(text).timestamp() // 60)
+
+
+def add_range(p):
+    p.add_argument("--store", default="govee_data", help="directory of downloaded readings")
+    p.add_argument("--start", help="first minute: index, ISO date/time, or -90m/-24h/-7d")
+    p.add_argument("--end", help="minute after the last, same forms as --start")
+
+
+def backend(args):
+    if args.sim:
+        from govee_sim import SimBackend
+
+        return SimBackend(ad_interval=0.1)
+    from govee_logger import BleakBackend
+
+    return BleakBackend(args.adapter, passive=args.passive)
+
+
+def models(args):
+    return args.models.split(",") if args.models else None
+
+
+def log_interval(text):
+    # MODEL=MINUTES or ADDRESS=MINUTES
+    key, _, minutes = text.rpartition("=")
+    if not key or not minutes.isdigit() or not int(minutes):
+        raise argparse.ArgumentTypeError(f"expected MODEL=MINUTES or ADDRESS=MINUTES, got {text!r}")
+    return key.upper(), int(minutes)
+
+
+def add_scan_options(p):
+    p.add_argument("--passive", action="store_true", help="scan without scan requests where supported")
+    p.add_argument(
+        "--models",
+        help="comma separated models to listen for, e.g. H5174,H5179; "
+        "when all advertise a service UUID the OS filters everything else out",
+    )
+
+
+class ReadingPrinter:
+    # stands in for a SinkWriter, printing advertised readings as they come
+    def offer(self, row):
+        address, minute, temp, humid, bat, _ = row
+        print(f"{time.strftime('%Y-%m-%dT%H:%M:%S')}\t{address}\t{temp}\t{humid}\t{bat}", flush=True)
+
+
+def cmd_scan(args):
+    import asyncio
+
+    from govee_logger import scan
+
+    known = asyncio.run(scan(args.time, backend(args), ReadingPrinter(), models(args)))
+    for d in known.values():
+        print(d, file=sys.stderr)
+    return 0
+
+
+def cmd_download(args):
+    import asyncio
+    import logging
+
+    import govee_logger
+    from govee_sinks import open_sink
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(message)s")
+    sinks = [open_sink(spec) for spec in args.sink]
+    if args.adapters:
+        import functools
+
+        from govee_shard import coordinate
+
+        report = asyncio.run(
+            coordinate(
+                args.adapters.split(","),
+                functools.partial(govee_logger.BleakBackend, passive=args.passive),
+                sinks=sinks,
+                state_path=args.state,
+                concurrency=args.concurrency,
+                timeout=args.timeout,
+                retries=args.retries,
+                backoff=args.backoff,
+                store_path=args.store,
+                scan_time=args.scan_time,
+                models=models(args),
+                log_intervals=dict(args.log_interval),
+            )
+        )
+    elif args.daemon:
+        asyncio.run(
+            govee_logger.daemon(
+                args.concurrency,
+                args.timeout,
+                args.retries,
+                args.backoff,
+                args.state,
+                args.store,
+                keep_open=args.keep_open,
+                backend=backend(args),
+                metrics_port=args.metrics_port,
+                sinks=sinks,
+                journal_path=args.journal,
+                models=models(args),
+                scan_window=args.scan_window,
+                log_intervals=dict(args.log_interval),
+                # left unset, the daemon's own defaults apply
+                **{
+                    k: v
+                    for k, v in (
+                        ("margin", args.margin),
+                        ("scan_interval", args.scan_interval),
+                        ("slow_scan_interval", args.slow_scan_interval),
+                    )
+                    if v is not None
+                },
+            )
+        )
+        return 0
+    else:
+        report = asyncio.run(
+            govee_logger.main(
+                args.concurrency,
+                args.timeout,
+                args.retries,
+                args.backoff,
+                args.state,
+                args.store,
+                scan_time=args.scan_time,
+                backend=backend(args),
+                metrics_port=args.metrics_port,
+                sinks=sinks,
+                journal_path=args.journal,
+                models=models(args),
+                log_intervals=dict(args.log_interval),
+            )
+        )
+    return 1 if report.failed else 0
+
+
+def addresses(store, args):
+    return [a.upper() for a in args.address] if args.address else store.addresses()
+
+
+def cmd_export(args):
+    import json
+
+    from govee_formats import CSV_HEADER, line_protocol
+    from govee_store import NO_BAT, GoveeStore
+
+    store = GoveeStore(args.store)
+    start, end = parse_minute(args.start), parse_minute(args.end)
+    out = sys.stdout
+    if args.format == "csv":
+        out.write(",".join(CSV_HEADER) + "\n")
+    for address in addresses(store, args):
+        q = store.series(address).query(start, end)
+        lines = []
+        for m, t, h, b in zip(q.minute, q.temp, q.humid, q.bat):
+            row = (address, m, t / 100, h / 100, None if b == NO_BAT else b, "history")
+            if args.format == "line":
+                lines.append(line_protocol(row))
+            elif args.format == "json":
+                lines.append(json.dumps(dict(zip(CSV_HEADER, row))) + "\n")
+            else:
+                lines.append(",".join("" if v is None else str(v) for v in row) + "\n")
+            if len(lines) >= 4096:
+                out.write("".join(lines))
+                lines.clear()
+        out.write("".join(lines))
+    return 0
+
+
+def cmd_query(args):
+    from govee_rollup import aggregate, buckets
+    from govee_store import GoveeStore
+
+    store = GoveeStore(args.store)
+    start, end = parse_minute(args.start), parse_minute(args.end)
+    for address in addresses(store, args):
+        series = store.series(address)
+        if args.bucket:
+            print("address\tminute\tcount\ttemp_min\ttemp_max\ttemp_mean\thumid_min\thumid_max\thumid_mean")
+            for b in buckets(series, args.bucket, start, end):
+                print(address, *(round(v, 2) for v in b), sep="\t")
+            continue
+        # open ends: minute 0 is a whole-day boundary, so rollups still apply
+        lo = 0 if start is None else start
+        hi = (series.last_index() or 0) + 1 if end is None else end
+        a = aggregate(series, lo, hi)
+        if a is None:
+            print(f"{address}\tno readings")
+        else:
+            print(address, *(f"{k}={round(v, 2)}" for k, v in a.items()), sep="\t")
+    return 0
+
+
+def cmd_decode(args):
+    # manufacturer data payloads, or with --bulk raw xx2013 notifications
+    from govee_codec import decode_h5174_rows, decode_h5179_rows
+    from govee_models import MODELS
+
+    spec = MODELS.get(args.model.upper())
+    if spec is None:
+        print(f"unknown model {args.model}, expected one of {', '.join(MODELS)}", file=sys.stderr)
+        return 2
+    frames = args.hex or [line.strip() for line in sys.stdin if line.strip()]
+    now = parse_minute(args.now) if args.now else int(time.time() // 60)
+    for text in frames:
+        data = bytes.fromhex(text.replace(" ", ""))
+        if not args.bulk:
+            print(text, spec.decode({spec.manufacturer_id: data}) or "no reading", sep="\t")
+        elif spec.bulk == "age":
+            for m, t, h in decode_h5174_rows(data, now):
+                print(m, t, h, sep="\t")
+        elif spec.bulk == "index":
+            for m, t, h in decode_h5179_rows(data):
+                print(m, t, h, sep="\t")
+        else:
+            print(f"{spec.model} keeps no history", file=sys.stderr)
+            return 2
+    return 0
+
+
+def cmd_replay(args):
+    # decode journaled transfers again and add anything missing to the store
+    from govee_journal import Journal, replay
+    from govee_models import MODELS
+    from govee_store import GoveeStore
+
+    journal = Journal(args.journal)
+    rows = replay(journal, {m: spec.bulk for m, spec in MODELS.items()})
+    journal.close()
+    store = GoveeStore(args.store) if args.store else None
+    for address, by_minute in sorted(rows.items()):
+        decoded = [by_minute[m] for m in sorted(by_minute)]
+        added = len(store.series(address).append(decoded)) if store else 0
+        print(f"{address}\t{len(decoded)} readings\t{added} new")
+    return 0
+
+
+def parser():
+    p = argparse.ArgumentParser(description="Govee thermo-hygrometer logger")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    s = sub.add_parser("scan", help="print advertised readings")
+    s.add_argument("--time", type=float, default=10.0, help="seconds to listen")
+    s.add_argument("--adapter", help="HCI adapter, e.g. hci1")
+    s.add_argument("--sim", action="store_true", help="use the simulated radio")
+    add_scan_options(s)
+    s.set_defaults(fn=cmd_scan)
+
+    d = sub.add_parser("download", help="sweep, or with --daemon keep downloading on schedule")
+    d.add_argument("--concurrency", type=int, default=4, help="devices downloaded at once per adapter")
+    d.add_argument("--timeout", type=float, default=120.0, help="per-device deadline in seconds")
+    d.add_argument("--retries", type=int, default=2)
+    d.add_argument("--backoff", type=float, default=2.0, help="initial retry delay in seconds")
+    d.add_argument("--state", default="govee_state.json", help="high-water mark file")
+    d.add_argument("--store", default="govee_data", help="directory for downloaded readings")
+    d.add_argument("--scan-time", type=float, default=10.0, help="seconds to scan before a sweep ends")
+    d.add_argument("--daemon", action="store_true", help="keep scanning and download on schedule")
+    d.add_argument("--margin", type=int, help="with --daemon, minutes before buffer wrap to download (60)")
+    d.add_argument("--keep-open", action="store_true", help="with --daemon, hold connections between downloads")
+    d.add_argument(
+        "--log-interval",
+        type=log_interval,
+        action="append",
+        default=[],
+        metavar="MODEL_OR_ADDRESS=MINUTES",
+        help="minutes between readings a device logs, as set in the app, e.g. H5179=10",
+    )
+    d.add_argument("--scan-window", type=float, help="with --daemon, scan this many seconds per interval")
+    d.add_argument(
+        "--scan-interval", type=float, help="with --daemon, seconds between scan windows while a probe is stale (10)"
+    )
+    d.add_argument(
+        "--slow-scan-interval", type=float, help="with --daemon, seconds between scan windows once all are fresh (60)"
+    )
+    add_scan_options(d)
+    d.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    d.add_argument(
+        "--sink",
+        action="append",
+        default=[],
+        help="also write readings to sqlite:PATH, csv:PATH or line:PATH|tcp://HOST:PORT|unix:PATH",
+    )
+    d.add_argument("--adapter", help="HCI adapter, e.g. hci1")
+    d.add_argument("--adapters", help="comma separated HCI adapters, one worker process each")
+    d.add_argument("--sim", action="store_true", help="use the simulated radio")
+    d.add_argument("--journal", help="record raw notifications to this file, decode off the event loop")
+    d.add_argument("-v", "--verbose", action="store_true", help="log every frame and reading")
+    d.set_defaults(fn=cmd_download)
+
+    e = sub.add_parser("export", help="write stored readings to stdout")
+    e.add_argument("address", nargs="*", help="devices to export, default all")
+    add_range(e)
+    e.add_argument("--format", choices=("csv", "line", "json"), default="csv")
+    e.set_defaults(fn=cmd_export)
+
+    q = sub.add_parser("query", help="min/max/mean from the hourly and daily rollups")
+    q.add_argument("address", nargs="*", help="devices to query, default all")
+    add_range(q)
+    q.add_argument("--bucket", type=int, choices=(60, 1440), help="per hour or per day rows")
+    q.set_defaults(fn=cmd_query)
+
+    c = sub.add_parser("decode", help="decode captured advertisement or bulk payloads")
+    c.add_argument("model", help="H5174, H5179, ...")
+    c.add_argument("hex", nargs="*", help="payloads in hex, default one per line on stdin")
+    c.add_argument("--bulk", action="store_true", help="payloads are xx2013 history rows")
+    c.add_argument("--now", help="reference minute for age-addressed rows, default now")
+    c.set_defaults(fn=cmd_decode)
+
+    r = sub.add_parser("replay", help="decode a notification journal again")
+    r.add_argument("journal")
+    r.add_argument("--store", help="add decoded readings to this store")
+    r.set_defaults(fn=cmd_replay)
+    return p
+
+
+def main(argv=None):
+    p = parser()
+    args = p.parse_args(argv)
+    if args.command == "download" and args.adapters:
+        # the adapter workers run plain sweeps over the radio
+        clash = [
+            flag
+            for flag, value in (
+                ("--adapter", args.adapter),
+                ("--sim", args.sim),
+                ("--daemon", args.daemon),
+                ("--journal", args.journal),
+                ("--metrics-port", args.metrics_port is not None),
+            )
+            if value
+        ]
+        if clash:
+            p.error(f"--adapters cannot be combined with {', '.join(clash)}")
+    if args.command == "download" and not args.daemon:
+        # sweeps have no schedule or scan cycle for these to tune
+        unused = [
+            flag
+            for flag, value in (
+                ("--scan-window", args.scan_window),
+                ("--scan-interval", args.scan_interval),
+                ("--slow-scan-interval", args.slow_scan_interval),
+                ("--margin", args.margin),
+                ("--keep-open", args.keep_open or None),
+            )
+            if value is not None
+        ]
+        if unused:
+            p.error(f"{', '.join(unused)} only apply with --daemon")
+    if args.command == "download" and args.log_interval:
+        from govee_models import MODELS
+
+        for key, _ in args.log_interval:
+            spec = MODELS.get(key)
+            if spec is not None and spec.bulk != "index":
+                p.error(f"--log-interval only applies to models with index-addressed history, not {key}")
+    return args.fn(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import struct
+
+# Frame layouts and checksums for the Govee GATT protocol, compiled once.
+#
+# Command/response frames on xx2011 and the H5174's xx2012 are 20 bytes: a
+# 2-byte opcode, payload, null padding and a trailing XOR of the first 19
+# bytes. XOR-ing all 20 bytes of a valid frame therefore gives zero.
+
+FRAME_SIZE = 20
+
+H5174_REQUEST = struct.Struct(">hhh")
+H5179_REQUEST = struct.Struct("<hII")
+CLOCK = struct.Struct("<I")
+# bulk history rows arrive as 20 byte notifications on xx2013
+H5179_ROW = struct.Struct("<ihhhhhhhh")
+# index + six 3-byte big-endian values, each split into a high byte and a
+# 16-bit remainder so the whole row is a single unpack
+H5174_ROW = struct.Struct(">h" + "BH" * 6)
+H5179_ADV = struct.Struct("<hhb")
+STATUS = struct.Struct("<b")
+
+# xx2011 replies, opcode -> metadata field
+META_FIELDS = {
+    0xAA20: "aa20_ver",
+    0xAA0D: "hardware",
+    0xAA0E: "firmware",
+}
+
+# H5174 xx2012 replies
+DOWNLOAD_ACCEPTED = 0x3301
+DOWNLOAD_COMPLETE = 0xEE01
+CLOCK_SET = 0x3310
+
+_MASK80 = (1 << 80) - 1
+_MASK40 = (1 << 40) - 1
+
+
+def xor20(data):
+    # XOR of 20 bytes by folding a single integer in halves
+    x = int.from_bytes(data, "little")
+    x ^= x >> 80
+    x &= _MASK80
+    x ^= x >> 40
+    x &= _MASK40
+    x ^= x >> 24
+    x &= 0xFFFFFF
+    x ^= x >> 16
+    x ^= x >> 8
+    return x & 0xFF
+
+
+def xor_bytes(data):
+    chk = 0
+    for b in data:
+        chk ^= b
+    return chk
+
+
+def opcode(data):
+    return data[0] << 8 | data[1]
+
+
+def stripnull(data: bytes):
+    return data.rstrip(b"\0").decode("UTF-8")
+
+
+def gv_rx_chk(data: bytes):
+    if type(data) not in (bytes, bytearray):
+        raise ValueError(f"Expected 'bytes' input, got {type(data)}")
+    if len(data) != 20:
+        raise ValueError(f"Expected 20 byte input, got {len(data)} bytes")
+    if xor20(data) == 0:
+        return data[:-1]
+    chk = xor_bytes(data[:-1])
+    raise ValueError(f"Incorrect checksum found {data[-1]} calculated {chk&0xFF}")
+
+
+def gv_tx_chk(data: bytes):
+    if type(data) is str:
+        data = bytes.fromhex(data)
+    if type(data) not in (bytes, bytearray):
+        raise ValueError(f"Expected 'bytes' input, got {type(data)}")
+    if len(data) >= 20:
+        raise ValueError(f"Expected <20 bytes, got {len(data)} bytes")
+
+    data = data + b"\x00" * (19 - len(data))  # right-pad with nulls
+    return data + bytes([xor_bytes(data)])
+
+
+def _frame_masks(count, keep):
+    # `keep` low bytes of each of `count` 20 byte frames, little-endian
+    pattern = b"\xff" * keep + b"\x00" * (FRAME_SIZE - keep)
+    return int.from_bytes(pattern * count, "little")
+
+
+_batch_masks = {}
+
+
+def frame_checksums(buf):
+    # XOR of each 20 byte frame in buf, all at once: the same folding as
+    # xor20() applied to every frame in one big integer. Valid frames give 0.
+    count = len(buf) // FRAME_SIZE
+    masks = _batch_masks.get(count)
+    if masks is None:
+        masks = tuple(_frame_masks(count, k) for k in (10, 5, 3, 1))
+        if len(_batch_masks) < 64:
+            _batch_masks[count] = masks
+    m10, m5, m3, m1 = masks
+    x = int.from_bytes(buf[: count * FRAME_SIZE], "little")
+    x = (x ^ x >> 80) & m10
+    x = (x ^ x >> 40) & m5
+    x = (x ^ x >> 24) & m3
+    x ^= x >> 16
+    x = (x ^ x >> 8) & m1
+    return x.to_bytes(count * FRAME_SIZE, "little")[::FRAME_SIZE]
+
+
+def bad_frames(buf):
+    # indices of frames in buf failing the checksum
+    return [i for i, c in enumerate(frame_checksums(buf)) if c]
+
+
+# requests with no arguments, ready to write
+REQUESTS = {op: gv_tx_chk(op.to_bytes(2, "big")) for op in (0xAA0D, 0xAA0E, 0xAA20, 0xAA01, 0xAA08)}
+
+
+def clock_frame(minute):
+    # WR > 3310 C693 A101 ... set the device clock, minute index little-endian
+    return gv_tx_chk(b"\x33\x10" + CLOCK.pack(minute))
+
+
+def h5174_request(tfrom, tto):
+    return gv_tx_chk(H5174_REQUEST.pack(0x3301, tfrom, tto))
+
+
+def h5179_request(tfrom, tto):
+    return H5179_REQUEST.pack(0, tfrom, tto)
+
+
+def decode_h5179_rows(buf, now=None, step=1):
+    # readings in a row are `step` minutes apart, the device's log interval
+    results = []
+    append = results.append
+    for index, t1, h1, t2, h2, t3, h3, t4, h4 in H5179_ROW.iter_unpack(buf):
+        if t1 == -1:
+            # row only has 3 values
+            append((index + 2 * step, t4 / 100, h4 / 100))
+            append((index + step, t3 / 100, h3 / 100))
+            append((index + 0, t2 / 100, h2 / 100))
+        else:
+            append((index + 3 * step, t4 / 100, h4 / 100))
+            append((index + 2 * step, t3 / 100, h3 / 100))
+            append((index + step, t2 / 100, h2 / 100))
+            append((index + 0, t1 / 100, h1 / 100))
+    return results
+
+
+def decode_h5174_rows(buf, now):
+    # t0 is at age `index` minutes before `now`, t1 one minute newer and so
+    # on. 0xFFFFFF marks a slot the device skipped (FIFO underrun) or one
+    # past the end of the requested range
+    results = []
+    append = results.append
+    for row in H5174_ROW.iter_unpack(buf):
+        base = now - row[0]
+        for i in range(6):
+            hi = row[1 + 2 * i]
+            lo = row[2 + 2 * i]
+            if hi == 0xFF and lo == 0xFFFF:
+                continue
+            if hi & 0x80:
+                # below freezing, as in the packed advertisement
+                t = (hi & 0x7F) << 16 | lo
+                append((base + i, -(t // 1000) / 10, (t % 1000) / 10))
+            else:
+                t = hi << 16 | lo
+                append((base + i, (t // 1000) / 10, (t % 1000) / 10))
+    return results
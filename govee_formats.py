@@ -0,0 +1,19 @@
+# Text forms of a reading row, shared by the sinks and `govee_cli export`.
+# Kept free of asyncio and the BLE stack so offline commands load quickly.
+#
+#   (address, minute index, temp, humid, battery % or None, source)
+
+CSV_HEADER = ("address", "minute", "temp", "humid", "bat", "source")
+
+
+def escape_tag(v):
+    return str(v).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def line_protocol(row):
+    # InfluxDB line protocol, second precision
+    address, minute, temp, humid, bat, source = row
+    fields = f"temp={temp},humid={humid}"
+    if bat is not None:
+        fields += f",bat={bat}i"
+    return f"govee,address={escape_tag(address)},source={source} {fields} {minute * 60}\n"
@@ -0,0 +1,123 @@
+import mmap
+import os
+import struct
+import time
+
+from govee_codec import decode_h5174_rows, decode_h5179_rows
+
+# Raw notification journal: a preallocated, memory-mapped ring of fixed-size
+# records, written from the GATT callbacks with one pack_into() each so the
+# event loop does no parsing there. Replaying it decodes the bulk transfers
+# again, e.g. after a decoder fix, without going back to the probes.
+#
+#   header   magic, record size, capacity
+#   record   sequence number (0 = never written), wall clock time, device
+#            address, GATT handle, channel, payload length, payload
+#
+# Times are wall clock rather than monotonic so replayed age-addressed rows
+# can be placed; a BEGIN record at the start of every transfer carries the
+# model and the exact reference minute.
+
+HEADER = struct.Struct("<4sII52x")
+RECORD = struct.Struct("<Qd6sHBB32s6x")
+MAGIC = b"GVJ1"
+
+# channel: the characteristic a frame arrived on, by UUID suffix
+BEGIN = 0x00
+MISC = 0x11
+REQUEST = 0x12
+BULK = 0x13
+BEGIN_PAYLOAD = struct.Struct("<i8s")
+# then the device's log interval, absent in journals written before it
+BEGIN_STEP = struct.Struct("<H")
+
+
+def address_bytes(address):
+    return bytes.fromhex(address.replace(":", ""))
+
+
+def address_text(raw):
+    return ":".join(f"{b:02X}" for b in raw)
+
+
+class Journal:
+    def __init__(self, path, capacity=1 << 16):
+        self.path = path
+        new = not os.path.exists(path) or os.path.getsize(path) < HEADER.size
+        self.f = open(path, "w+b" if new else "r+b")
+        if new:
+            self.f.write(HEADER.pack(MAGIC, RECORD.size, capacity))
+            self.f.truncate(HEADER.size + capacity * RECORD.size)
+        else:
+            magic, size, capacity = HEADER.unpack(self.f.read(HEADER.size))
+            if magic != MAGIC or size != RECORD.size:
+                raise ValueError(f"{path} is not a version 1 Govee journal")
+        self.capacity = capacity
+        self.map = mmap.mmap(self.f.fileno(), 0)
+        self.addresses = {}
+        self.seq = self.last_seq() + 1
+
+    def last_seq(self):
+        last = 0
+        for i in range(self.capacity):
+            (seq,) = struct.unpack_from("<Q", self.map, HEADER.size + i * RECORD.size)
+            last = max(last, seq)
+        return last
+
+    def append(self, address, channel, handle, data):
+        # called from notification callbacks: one pack into the mapping
+        raw = self.addresses.get(address)
+        if raw is None:
+            raw = self.addresses[address] = address_bytes(address)
+        seq = self.seq
+        self.seq = seq + 1
+        offset = HEADER.size + (seq % self.capacity) * RECORD.size
+        RECORD.pack_into(self.map, offset, seq, time.time(), raw, handle & 0xFFFF, channel, len(data), bytes(data))
+
+    def begin(self, address, model, now, step=1):
+        self.append(address, BEGIN, 0, BEGIN_PAYLOAD.pack(now, model.encode()) + BEGIN_STEP.pack(step))
+
+    def records(self, since=0):
+        # (seq, time, address, handle, channel, payload) in order, for
+        # records after `since` still held in the ring
+        first = max(since + 1, self.seq - self.capacity, 1)
+        for seq in range(first, self.seq):
+            offset = HEADER.size + (seq % self.capacity) * RECORD.size
+            s, t, raw, handle, channel, n, payload = RECORD.unpack_from(self.map, offset)
+            if s == seq:
+                yield s, t, address_text(raw), handle, channel, payload[:n]
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.f.close()
+
+
+def replay(journal, bulk_formats, since=0):
+    # Decodes journaled bulk transfers again. bulk_formats maps a model name
+    # to its bulk format ("age" or "index", see govee_models). Returns
+    # address -> {minute: (minute, temp, humid)}.
+    current = {}
+    rows = {}
+    for _, _, address, _, channel, payload in journal.records(since):
+        if channel == BEGIN:
+            now, model = BEGIN_PAYLOAD.unpack_from(payload)
+            step = 1
+            if len(payload) >= BEGIN_PAYLOAD.size + BEGIN_STEP.size:
+                (step,) = BEGIN_STEP.unpack_from(payload, BEGIN_PAYLOAD.size)
+            current[address] = (bulk_formats.get(model.rstrip(b"\0").decode()), now, step)
+        elif channel == BULK and address in current:
+            fmt, now, step = current[address]
+            if fmt == "age":
+                decoded = decode_h5174_rows(payload, now)
+            elif fmt == "index":
+                decoded = decode_h5179_rows(payload, step=step)
+            else:
+                continue
+            out = rows.setdefault(address, {})
+            for r in decoded:
+                out[r[0]] = r
+    return rows
@@ -1,343 +1,1604 @@
 import asyncio
-from bleak import BleakScanner, BleakClient
+from collections import OrderedDict, deque
 from datetime import datetime
 import logging
 import functools
-import struct
+import heapq
+import json
+import os
+import time
 
+from govee_codec import (
+    CLOCK_SET,
+    DOWNLOAD_ACCEPTED,
+    DOWNLOAD_COMPLETE,
+    META_FIELDS,
+    REQUESTS,
+    STATUS,
+    clock_frame,
+    decode_h5174_rows,
+    decode_h5179_rows,
+    gv_rx_chk,
+    gv_tx_chk,
+    h5174_request,
+    h5179_request,
+    opcode,
+    stripnull,
+)
+from govee_journal import BULK, REQUEST, Journal
+from govee_metrics import (
+    ADVERTISEMENTS,
+    CHECKSUM_FAILURES,
+    CONNECT_FAILURES,
+    CONNECT_SECONDS,
+    DOWNLOAD_RATE,
+    DOWNLOAD_ROWS,
+    DOWNLOAD_SECONDS,
+    NOTIFICATION_BYTES,
+    NOTIFICATIONS,
+    READINGS_SKIPPED,
+    TRANSFER_STALLS,
+    metrics,
+)
+from govee_models import MODELS
+from govee_sinks import SinkWriter
+from govee_store import GoveeStore, ReadingBatch
 
-def stripnull(data: bytes):
-    return data.rstrip(b"\0").decode("UTF-8")
+# per-frame and per-reading chatter is logged at DEBUG, so it costs a level
+# check unless asked for
+log = logging.getLogger("govee")
 
 
-def gv_rx_chk(data: bytes):
-    if type(data) not in (bytes, bytearray):
-        raise ValueError(f"Expected 'bytes' input, got {type(data)}")
-    if len(data) != 20:
-        raise ValueError(f"Expected 20 byte input, got {len(data)} bytes")
-    chk = 0
-    for i in range(len(data) - 1):
-        chk = chk ^ int(data[i])
-    if chk & 0xFF == data[-1]:
-        return data[:-1]
-    raise ValueError(f"Incorrect checksum found {data[-1]} calculated {chk&0xFF}")
+def now_minute():
+    # devices index history by UNIX timestamp / 60
+    return int(time.time() // 60)
 
 
-def gv_tx_chk(data: bytes):
-    if type(data) is str:
-        data = bytes.fromhex(data)
-    if type(data) not in (bytes, bytearray):
-        raise ValueError(f"Expected 'bytes' input, got {type(data)}")
-    if len(data) >= 20:
-        raise ValueError(f"Expected <20 bytes, got {len(data)} bytes")
+class BleakBackend:
+    # the radio: anything providing scanner() and client() in the shape of
+    # BleakScanner / BleakClient can stand in, see govee_sim.SimBackend.
+    # adapter picks the HCI interface ("hci1"), None for the system default.
+    # passive scanning sends no scan requests; bleak 0.14 honours it on
+    # Windows only and scans actively elsewhere.
+    def __init__(self, adapter=None, passive=False):
+        self.adapter = adapter
+        self.passive = passive
+        self.kwargs = {"adapter": adapter} if adapter else {}
 
-    data = data + b"\x00" * (19 - len(data))  # right-pad with nulls
-    chk = 0
-    for i in range(len(data)):
-        chk = chk ^ int(data[i])
-    return data + bytes([chk & 0xFF])
+    # bleak (and dbus on Linux) is only imported once a radio is needed
+    def scanner(self, service_uuids=None):
+        # service_uuids: deliver only advertisements carrying one of these,
+        # filtered by the OS (a BlueZ discovery filter on Linux)
+        from bleak import BleakScanner
+
+        kwargs = dict(self.kwargs)
+        if self.passive:
+            kwargs["scanning_mode"] = "passive"
+        if service_uuids:
+            kwargs["service_uuids"] = list(service_uuids)
+        return BleakScanner(**kwargs)
+
+    def client(self, address, timeout=30):
+        from bleak import BleakClient
+
+        return BleakClient(address, timeout=timeout, **self.kwargs)
+
+
+default_backend = BleakBackend()
 
 
 class DeviceFilter:
+    # Instances keep their state in slots. Overriding a class-level setting on
+    # one device, such as log_interval, still works: that is the only time an
+    # instance __dict__ gets allocated.
+    __slots__ = (
+        "device",
+        "advertisement_data",
+        "backend",
+        "history",
+        "last_emit",
+        "last_seen",
+        "last_stored",
+        "__dict__",
+    )
+    # used by CheckerIndex to pick candidate classes without calling accept()
+    name_prefix = None
+    manufacturer_ids = ()
+    # opcodes get_meta_from_client() asks for
+    meta_requests = ()
+    # on-device history: readings held and minutes between readings, which
+    # together say how long until unread history is overwritten. The H5179
+    # app offers 10/30/60 minute logging; detection_callback sets
+    # log_interval per device from `log_intervals` to match, unless the
+    # model only logs every minute.
+    buffer_capacity = 0
+    log_interval = 1
+    fixed_log_interval = False
+    # whether probe_devs has anything to fetch from the device
+    downloads = False
+    # service UUID every advertisement carries, for OS-level scan filters
+    service_uuid = None
+
     @staticmethod
     def accept(device, advertisement) -> bool:
         return False
 
+    # advertisement handling: keep the last `history_size` distinct readings,
+    # report a reading when it changes but not more often than
+    # `min_interval` seconds, and repeat an unchanged one every `heartbeat`
+    # seconds (None to disable)
+    history_size = 64
+    min_interval = 0.0
+    heartbeat = 300.0
+
     def advertisement(self, advertisement) -> None:
         pass
 
-    def __init__(self, device, advertisement):
+    def __init__(self, device, advertisement, backend=None):
         self.device = device
         self.advertisement_data = advertisement
-        self.ads = set()
+        self.backend = backend or default_backend
+        self.history = deque(maxlen=self.history_size)
+        self.last_emit = None
+        self.last_seen = None
+        # minute of the last advertised reading written to the store
+        self.last_stored = None
+
+    def update(self, advertisement, now=None):
+        # returns the decoded reading when downstream should hear about it
+        reading = self.advertisement(advertisement)
+        if not reading:
+            return None
+        if now is None:
+            now = time.monotonic()
+        self.last_seen = now
+        if self.last_emit is not None:
+            since = now - self.last_emit
+            if reading == self.history[-1][1]:
+                if self.heartbeat is None or since < self.heartbeat:
+                    return None
+            elif since < self.min_interval:
+                return None
+        self.last_emit = now
+        self.history.append((time.time(), reading))
+        return reading
 
     async def get_meta(self):
-        client = BleakClient(self.device.address, timeout=30)
-        await client.connect()
-        meta = await self.get_meta_from_client(client)
-        await client.disconnect()
-        return meta
+        async with DeviceSession(self) as session:
+            return await session.get_meta()
 
     async def get_meta_from_client(self, client):
         return {}
 
-    async def do_download(self):
-        client = BleakClient(self.device.address, timeout=30)
-        await client.connect()
-        meta = await self.do_download_from_client(client)
-        await client.disconnect()
-        return meta
+    async def stream_download(self, since=None, chunk_rows=64, progress=None):
+        # async generator of (minute index, temp, humid) readings, yielded
+        # while the transfer is still running
+        async with DeviceSession(self) as session:
+            async for r in session.stream_download(since, chunk_rows, progress):
+                yield r
 
-    async def do_download_from_client(self, client):
-        return []
+    async def stream_download_from_client(self, client, since=None, chunk_rows=64, progress=None):
+        # since: last minute index already stored, None for a full download;
+        # progress: a DownloadProgress to record which minutes arrived
+        return
+        yield
+
+    async def set_clock_from_client(self, client, minute=None):
+        return False
+
+    async def do_download(self, since=None):
+        rows = ReadingBatch()
+        try:
+            async for r in self.stream_download(since):
+                rows.append(r)
+        except TransferStalled as e:
+            e.rows = rows
+            raise
+        return rows
+
+    async def do_download_from_client(self, client, since=None):
+        rows = ReadingBatch()
+        try:
+            async for r in self.stream_download_from_client(client, since):
+                rows.append(r)
+        except TransferStalled as e:
+            e.rows = rows
+            raise
+        return rows
 
     def __repr__(self):
         return f"?? {self.device}"
 
 
+class MetaReplies:
+    # collects xx2011 replies until every requested opcode has answered
+    def __init__(self, ops):
+        self.meta = {}
+        self.pending = set(ops)
+        self.done = asyncio.Event()
+        if not self.pending:
+            self.done.set()
+
+    def add(self, op, value):
+        self.meta[META_FIELDS[op]] = value
+        self.pending.discard(op)
+        if not self.pending:
+            self.done.set()
+
+    @property
+    def complete(self):
+        return not self.pending
+
+
+class MetaCache:
+    # firmware/hardware strings by address, re-fetched after `ttl` seconds
+    def __init__(self, ttl=24 * 3600):
+        self.ttl = ttl
+        self.entries = {}
+
+    def get(self, address):
+        entry = self.entries.get(address)
+        if entry is None:
+            return None
+        expires, meta = entry
+        if time.monotonic() >= expires:
+            del self.entries[address]
+            return None
+        return meta
+
+    def put(self, address, meta):
+        self.entries[address] = (time.monotonic() + self.ttl, meta)
+
+
+class DeviceSession:
+    # One connection for the whole interaction with a device: metadata, clock
+    # set and history download. The link is (re)established with backoff
+    # whenever an operation finds it down.
+    def __init__(
+        self, device, timeout=30, connect_retries=3, backoff=1.0, meta_cache=None, journal=None
+    ):
+        self.device = device
+        self.meta_cache = meta_cache
+        self.journal = journal
+        self.timeout = timeout
+        self.connect_retries = connect_retries
+        self.backoff = backoff
+        self.client = None
+        self.connects = 0
+
+    @property
+    def connected(self):
+        return self.client is not None and self.client.is_connected
+
+    async def connect(self):
+        attempt = 0
+        while True:
+            client = self.device.backend.client(self.device.device.address, timeout=self.timeout)
+            t0 = time.monotonic()
+            try:
+                await client.connect()
+            except Exception:
+                CONNECT_FAILURES.inc()
+                if attempt >= self.connect_retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                log.warning("%s connect failed, retrying in %ss", self.device, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            CONNECT_SECONDS.observe(time.monotonic() - t0)
+            self.client = client
+            self.connects += 1
+            return client
+
+    async def ensure(self):
+        if not self.connected:
+            await self.connect()
+        return self.client
+
+    async def close(self):
+        client, self.client = self.client, None
+        if client is not None:
+            try:
+                await client.disconnect()
+            except Exception:
+                log.exception("%s disconnect", self.device)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def get_meta(self):
+        address = self.device.device.address
+        if self.meta_cache is not None:
+            meta = self.meta_cache.get(address)
+            if meta is not None:
+                return meta
+        meta = await self.device.get_meta_from_client(await self.ensure())
+        # partial answers are not cached so the next sweep asks again
+        if self.meta_cache is not None and set(meta) >= {
+            META_FIELDS[op] for op in self.device.meta_requests
+        }:
+            self.meta_cache.put(address, meta)
+        return meta
+
+    async def set_clock(self, minute=None):
+        return await self.device.set_clock_from_client(await self.ensure(), minute)
+
+    async def stream_download(self, since=None, chunk_rows=64, progress=None):
+        client = await self.ensure()
+        kwargs = {} if self.journal is None else {"journal": self.journal}
+        if progress is not None:
+            kwargs["progress"] = progress
+        async for r in self.device.stream_download_from_client(client, since, chunk_rows, **kwargs):
+            yield r
+
+
+class SessionPool:
+    # hands out one DeviceSession per address; with keep_open the link is
+    # left up after a sweep for devices that stay in range
+    def __init__(self, keep_open=False, meta_cache=None, journal=None):
+        self.keep_open = keep_open
+        self.meta_cache = meta_cache if meta_cache is not None else MetaCache()
+        self.journal = journal
+        self.sessions = {}
+
+    def session(self, d):
+        s = self.sessions.get(d.device.address)
+        if s is None or s.device is not d:
+            s = DeviceSession(d, meta_cache=self.meta_cache, journal=self.journal)
+            self.sessions[d.device.address] = s
+        return s
+
+    async def release(self, session, failed=False):
+        if failed or not self.keep_open:
+            await session.close()
+
+    async def close(self):
+        for s in self.sessions.values():
+            await s.close()
+        self.sessions.clear()
+
+
+def find_gaps(seen, first, head=False, step=1):
+    # Spans of minutes missing from a transfer, given a bitmap of `step`
+    # minute slots (one reading each) starting at minute `first`: holes
+    # between readings that did arrive, and a tail cut off when a transfer
+    # ended early. Minutes before the oldest reading only count with `head`,
+    # otherwise the device may simply hold less history.
+    start = seen.find(1)
+    if start < 0:
+        return []
+    end = seen.rfind(1)
+    gaps = []
+    if head and start > 0:
+        gaps.append((first, first + start * step - 1))
+    i = seen.find(0, start, end)
+    while i >= 0:
+        j = seen.find(1, i, end + 1)
+        gaps.append((first + i * step, first + j * step - 1))
+        i = seen.find(0, j, end)
+    # the newest reading may not have been logged yet
+    if end < len(seen) - 2:
+        gaps.append((first + (end + 1) * step, first + (len(seen) - 1) * step - 1))
+    return gaps
+
+
+class DownloadProgress:
+    # Readings of the requested window that have arrived, one slot per
+    # `step` minutes, shared with the caller so a download that ends early
+    # can still be checkpointed.
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.step = 1
+        self.seen = bytearray()
+        self.head = False
+        # spans given up on: asked for again, and still not there
+        self.skipped = []
+
+    def start(self, first, last, head, step=1):
+        self.first = first
+        self.last = last
+        self.step = step
+        self.seen = bytearray((last - first) // step + 1)
+        self.head = head
+        self.skipped = []
+
+    def skip(self, spans):
+        # let the mark pass readings the device does not hold
+        step = self.step
+        for lo, hi in spans:
+            for i in range((lo - self.first) // step, (hi - self.first) // step + 1):
+                if not self.seen[i]:
+                    self.seen[i] = 2
+        self.skipped.extend(spans)
+
+    def resume(self):
+        # newest minute with nothing missing before it, None if unknown.
+        # Without `head` the device may hold nothing before the oldest
+        # reading that arrived.
+        if self.first is None:
+            return None
+        seen = self.seen
+        start = 0 if self.head else seen.find(1)
+        if start < 0:
+            return None
+        hole = seen.find(0, start)
+        if hole < 0:
+            return self.last
+        return self.first + hole * self.step - 1
+
+
+def merge_spans(spans, limit):
+    # coalesce the closest neighbours until at most `limit` spans remain
+    spans = list(spans)
+    while len(spans) > limit:
+        k = min(range(len(spans) - 1), key=lambda k: spans[k + 1][0] - spans[k][1])
+        spans[k : k + 2] = [(spans[k][0], spans[k + 1][1])]
+    return spans
+
+
+class TransferStalled(Exception):
+    # The xx2013 stream went quiet before the transfer finished. Readings
+    # that did arrive have been handed on; `resume` is the newest minute
+    # below which none are missing (None if not even the first arrived), and
+    # do_download() attaches what it had gathered as `rows`.
+    def __init__(self, message, resume=None):
+        super().__init__(message)
+        self.resume = resume
+        self.rows = None
+
+
+class DownloadRefused(Exception):
+    # the device answered the range request with a refusal and sent nothing
+    pass
+
+
+class Transfer:
+    # Collects raw xx2013 notifications for one download. BLE notifications
+    # cannot be paused, so the callback only appends to a byte buffer and the
+    # consumer decodes it a chunk at a time, bounding the decoded rows held
+    # in memory to what the consumer has not yet taken.
+    #
+    # A watchdog ends the transfer when the stream goes quiet: after
+    # start_timeout without a first notification, or later after
+    # idle_factor times the mean gap between notifications so far (at least
+    # idle_min seconds). If the `expected` number of frames had arrived by
+    # then, only the closing status was lost and the transfer counts as
+    # complete; otherwise chunks() raises TransferStalled.
+    def __init__(
+        self, chunk_rows=64, row_size=20, expected=None, start_timeout=10.0, idle_min=2.0, idle_factor=8.0
+    ):
+        self.buf = bytearray()
+        self.row_size = row_size
+        self.threshold = chunk_rows * row_size
+        self.done = False
+        self.refused = False
+        self.wake = asyncio.Event()
+        self.notifications = 0
+        self.bytes = 0
+        self.expected = expected
+        self.start_timeout = start_timeout
+        self.idle_min = idle_min
+        self.idle_factor = idle_factor
+        self.started = time.monotonic()
+        self.first_rx = None
+        self.last_rx = None
+
+    def feed(self, handle, data):
+        self.buf += data
+        self.notifications += 1
+        self.bytes += len(data)
+        self.last_rx = time.monotonic()
+        if self.first_rx is None:
+            self.first_rx = self.last_rx
+        if len(self.buf) >= self.threshold:
+            self.wake.set()
+
+    def set(self):
+        # end of transfer, called by the xx2012 status handlers
+        self.done = True
+        self.wake.set()
+
+    def refuse(self):
+        self.refused = True
+        self.set()
+
+    def idle_limit(self):
+        if self.last_rx is None:
+            return self.start_timeout
+        if self.notifications < 2:
+            return self.idle_min
+        gap = (self.last_rx - self.first_rx) / (self.notifications - 1)
+        return max(self.idle_min, self.idle_factor * gap)
+
+    def quiet_for(self):
+        return time.monotonic() - (self.last_rx or self.started)
+
+    async def wait(self):
+        # returns True once the watchdog gives up on the stream
+        while True:
+            remaining = self.idle_limit() - self.quiet_for()
+            if remaining <= 0:
+                return True
+            try:
+                await asyncio.wait_for(self.wake.wait(), remaining)
+                return False
+            except asyncio.TimeoutError:
+                pass
+
+    async def chunks(self):
+        stalled = False
+        while True:
+            if await self.wait():
+                if self.expected is not None and self.bytes >= self.expected * self.row_size:
+                    self.done = True
+                else:
+                    stalled = True
+            self.wake.clear()
+            # read before yielding: the consumer may await while the rest of
+            # the transfer and its end arrive
+            done = self.done
+            n = len(self.buf) - len(self.buf) % self.row_size
+            if n:
+                chunk = bytes(self.buf[:n])
+                del self.buf[:n]
+                yield chunk
+            if stalled:
+                raise TransferStalled(
+                    f"no notification for {self.quiet_for():.1f}s after {self.notifications}"
+                    + ("" if self.expected is None else f" of {self.expected}")
+                )
+            if done:
+                return
+
+
 class Govee_Device(DeviceFilter):
+    __slots__ = ()
     umisc = "494e5445-4c4c-495f-524f-434b535f2011"
     ureq = "494e5445-4c4c-495f-524f-434b535f2012"
     ubulk = "494e5445-4c4c-495f-524f-434b535f2013"
+    # model name, as in govee_models.MODELS
+    model = None
 
+    # xx2011 queries answered by the model, and how long to wait for them
+    meta_requests = (0xAA0D, 0xAA0E)
+    meta_deadline = 5.0
 
-    def handler_2011(self, meta, handle, data):
-        print(f"VR < handle={handle} data={data}")
-        data = gv_rx_chk(data)
-        msgtype = data[0:2]
-        value = data[2:]
-        if msgtype == bytes.fromhex("AA20"):
-            meta["aa20_ver"] = stripnull(value)
-        elif msgtype == bytes.fromhex("AA0D"):
-            meta["hardware"] = stripnull(value)
-        elif msgtype == bytes.fromhex("AA0E"):
-            meta["firmware"] = stripnull(value)
+    def rx_frame(self, data):
+        # gv_rx_chk, counting failures against the device
+        try:
+            return gv_rx_chk(data)
+        except ValueError:
+            CHECKSUM_FAILURES.inc(self.device.address)
+            raise
+
+    def handler_2011(self, replies, handle, data):
+        log.debug("VR < handle=%s data=%s", handle, data)
+        data = self.rx_frame(data)
+        op = opcode(data)
+        if op in META_FIELDS:
+            replies.add(op, stripnull(data[2:]))
         else:
-            print("!! unknown response")
+            log.warning("%s unknown response %s", self, data.hex())
 
+    async def get_meta_from_client(self, client):
+        # returns as soon as every query has been answered, or with whatever
+        # arrived once meta_deadline passes
+        replies = MetaReplies(self.meta_requests)
+        await client.start_notify(
+            self.umisc, functools.partial(self.handler_2011, replies)
+        )
+        try:
+            for op in self.meta_requests:
+                await client.write_gatt_char(self.umisc, REQUESTS[op])
+            await asyncio.wait_for(replies.done.wait(), self.meta_deadline)
+        except asyncio.TimeoutError:
+            missing = ", ".join(f"{op:04X}" for op in sorted(replies.pending))
+            log.warning("%s no reply to %s within %ss", self, missing, self.meta_deadline)
+        finally:
+            await client.stop_notify(self.umisc)
+        return replies.meta
 
-class Govee_H5174(Govee_Device):
-    # device has bluetooth
-    # reads temperature and humidity
-    @staticmethod
-    def accept(device, advertisement) -> bool:
-        name = advertisement.local_name
-        return name is not None and name.startswith("GVH5174_")
+    def handler_clock(self, done, handle, data):
+        if opcode(self.rx_frame(data)) == CLOCK_SET:
+            done.set()
 
-    def __repr__(self):
-        return f"Govee H5174 {self.device.address}"
+    async def set_clock_from_client(self, client, minute=None):
+        # WR > 3310 C693 A101 ...  VN < 3310 0000 ...
+        if minute is None:
+            minute = now_minute()
+        done = asyncio.Event()
+        await client.start_notify(self.umisc, functools.partial(self.handler_clock, done))
+        try:
+            await client.write_gatt_char(self.umisc, clock_frame(minute))
+            await asyncio.wait_for(done.wait(), 2.0)
+            return True
+        except asyncio.TimeoutError:
+            log.warning("%s clock set not acknowledged", self)
+            return False
+        finally:
+            await client.stop_notify(self.umisc)
 
-    # AdvertisementData(local_name='GVH5174_6BE0',
-    # manufacturer_data={1: b'\x01\x01\x02\xf7\xd6d', 76: b'\x02\x15INTELLI_ROCKS_HWPu\xf2\xff\xc2'},
-    # service_uuids=['0000ec88-0000-1000-8000-00805f9b34fb'])
-    def advertisement(self, advertisement):
-        dx = advertisement.manufacturer_data[1]
-        assert dx[0:2].hex() == "0101"
-        (ds,) = struct.unpack(">i", b"\x00" + dx[2:5])
-        temp = (ds // 1000) / 10
-        humid = (ds % 1000) / 10
-        print(f" {self} temp={temp} humid={humid} bat={dx[5]}%")
-        self.ads.add(dx)
-        return {"temp": temp, "humid": humid, "bat": dx[5]}
+    # extra passes requesting only the minutes missing after a transfer
+    refetch_rounds = 2
+    # at most this many narrow requests per pass; nearby gaps are merged
+    refetch_spans = 16
+    # narrowest window to halve down to when a request is refused
+    narrow_min = 60
+    # inactivity watchdog on the xx2013 stream, see Transfer
+    start_timeout = 10.0
+    idle_min = 2.0
+    idle_factor = 8.0
+    # readings in a full xx2013 row, to size the expected transfer
+    readings_per_row = None
 
-    async def get_meta_from_client(self, client):
-        meta = {}
-        print("interrogating 5174")
-        await client.start_notify(
-            self.umisc, functools.partial(self.handler_2011, meta)
-        )
-        await client.write_gatt_char(self.umisc, gv_tx_chk("AA0D"))
-        await client.write_gatt_char(self.umisc, gv_tx_chk("AA0E"))
-        await asyncio.sleep(2.0)
-        await client.stop_notify(self.umisc)
-        return meta
+    # xx2012 download status -> (log level, message, Transfer method to call
+    # or None while the transfer goes on), set by the history protocol
+    download_statuses = {}
 
+    def download_window(self, since):
+        # (first, last) minute index to fetch, or None when there is nothing
+        # newer than `since`: as far back as the buffer reaches
+        if not self.buffer_capacity:
+            return None
+        now = now_minute()
+        first = now - self.buffer_capacity * self.log_interval
+        if since is not None:
+            first = max(first, since + 1)
+        if first > now:
+            return None
+        return first, now
 
-    async def do_download_from_client(self, client):
-        print(f" {self} connected for download")
-        download_done = asyncio.Event()
-        results = []
-        await client.start_notify(
-            self.ubulk, functools.partial(self.handler_2013, results)
-        )
-        await client.start_notify(
-            self.ureq, functools.partial(self.handler_2012, download_done)
-        )
-        tfrom = 10800
-        tto = 0
-        await client.write_gatt_char(self.ureq, gv_tx_chk(struct.pack(">hhh", 0x3301, tfrom, tto)))
-        print(f" {self} waiting for bulk data from {tfrom} to {tto}")
-        await download_done.wait()
-        await client.stop_notify(self.ureq)
-        await client.stop_notify(self.ubulk)
-        return results
-
-    def handler_2012(self, finished, handle, data):
-        print(f"VR < handle={handle} data={data.hex()}")
-        data = gv_rx_chk(data)
-        msgtype = data[0:2]
-        value = data[2:]
-        if msgtype == bytes.fromhex("3301"):
-            print("Download accepted")
-            #finished.set()
-        elif msgtype == bytes.fromhex("ee01"):
-            print("Download complete")
-            finished.set()
-        else:
-            print(f"unknown download status: {data.hex()}!")
+    def range_request(self, first, last):
+        # returns (xx2012 request frame, reference minute, description)
+        return None
+
+    def decode_rows(self, buf, now):
+        return []
+
+    def download_status(self, transfer, status, data):
+        entry = self.download_statuses.get(status)
+        if entry is None:
+            log.warning("%s unknown download status: %s", self, data.hex())
+            return
+        level, message, end = entry
+        log.log(level, "%s %s", self, message)
+        if end is not None:
+            getattr(transfer, end)()
+
+    def expected_rows(self, first, last):
+        if self.readings_per_row is None:
+            return None
+        return -(-((last - first) // self.log_interval + 1) // self.readings_per_row)
 
     def index_to_ts(self, index):
         return datetime.fromtimestamp(index * 60)
 
-    def handler_2013(self, results, handle, data):
-        # print(f"VR < handle={handle} data={data}")
+    async def stream_download_from_client(
+        self, client, since=None, chunk_rows=64, journal=None, progress=None
+    ):
+        log.debug("%s connected for download", self)
+        window = self.download_window(since)
+        if window is None:
+            log.info("%s nothing new since %s", self, since)
+            return
+        first, last = window
+        # resuming from `since`: the device held readings right up to it
+        head = since is not None and first == since + 1
+        if progress is None:
+            progress = DownloadProgress()
+        step = self.log_interval
+        progress.start(first, last, head, step)
+        seen = progress.seen
+        spans = [window]
+        for attempt in range(self.refetch_rounds + 1):
+            for lo, hi in spans:
+                while True:
+                    try:
+                        async for r in self.stream_range(client, lo, hi, chunk_rows, journal):
+                            i = (r[0] - first) // step
+                            if 0 <= i < len(seen):
+                                if seen[i]:
+                                    continue
+                                seen[i] = 1
+                            yield r
+                    except TransferStalled as e:
+                        # everything up to the first hole is safe to skip next time
+                        e.resume = progress.resume()
+                        raise
+                    except DownloadRefused:
+                        # a lower bound older than the device holds: without
+                        # `head` ask again for the newer half, down to an hour
+                        if not head and not attempt and hi - lo >= self.narrow_min:
+                            lo = hi - (hi - lo) // 2
+                            log.info("%s asking again from %s", self, lo)
+                            continue
+                    break
+            gaps = find_gaps(seen, first, head, step)
+            if not gaps:
+                return
+            missing = sum(-(-(hi - lo + 1) // step) for lo, hi in gaps)
+            spans = merge_spans(gaps, self.refetch_spans)
+            if attempt < self.refetch_rounds:
+                log.info("%s refetching %d missing readings in %d spans", self, missing, len(spans))
+            elif attempt:
+                # asked for again and the transfer completed without them:
+                # the device never logged them (power cycle, battery swap,
+                # clock set forward), so they must not hold the mark back
+                progress.skip(gaps)
+                READINGS_SKIPPED.inc(self.device.address, n=missing)
+                log.warning("%s does not hold %d readings, skipping %s", self, missing, gaps)
+            else:
+                log.warning(
+                    "%s still missing %d readings, resuming from %s", self, missing, progress.resume()
+                )
+
+    async def stop_notify(self, client, uuid):
+        # after a stall the link may be gone: teardown must neither hang nor
+        # replace the error being raised
+        try:
+            await asyncio.wait_for(client.stop_notify(uuid), self.idle_min)
+        except Exception as e:
+            log.debug("%s stop_notify %s: %r", self, uuid[-4:], e)
+
+    def journaled(self, journal, channel, handler):
+        # notification callback that records the raw frame first
+        address = self.device.address
+        append = journal.append
+
+        def record(handle, data):
+            append(address, channel, handle, data)
+            handler(handle, data)
+
+        return record
+
+    async def stream_range(self, client, first, last, chunk_rows=64, journal=None):
+        # With a journal the callbacks only record and buffer frames, and
+        # decoding runs on an executor thread instead of the event loop.
+        frame, now, desc = self.range_request(first, last)
+        transfer = Transfer(
+            chunk_rows,
+            expected=self.expected_rows(first, last),
+            start_timeout=self.start_timeout,
+            idle_min=self.idle_min,
+            idle_factor=self.idle_factor,
+        )
+        on_bulk = transfer.feed
+        on_request = functools.partial(self.handler_2012, transfer)
+        if journal is not None:
+            journal.begin(self.device.address, self.model, now, self.log_interval)
+            on_bulk = self.journaled(journal, BULK, on_bulk)
+            on_request = self.journaled(journal, REQUEST, on_request)
+        await client.start_notify(self.ubulk, on_bulk)
+        await client.start_notify(self.ureq, on_request)
+        try:
+            await client.write_gatt_char(self.ureq, frame)
+            log.debug("%s waiting for bulk data from %s", self, desc)
+            loop = asyncio.get_running_loop()
+            async for chunk in transfer.chunks():
+                if journal is None:
+                    rows = self.decode_rows(chunk, now)
+                else:
+                    rows = await loop.run_in_executor(None, self.decode_rows, chunk, now)
+                for r in rows:
+                    yield r
+            if transfer.refused:
+                raise DownloadRefused(desc)
+        except TransferStalled:
+            TRANSFER_STALLS.inc(self.device.address)
+            log.warning("%s transfer of %s stalled", self, desc)
+            raise
+        finally:
+            await self.stop_notify(client, self.ureq)
+            await self.stop_notify(client, self.ubulk)
+            address = self.device.address
+            NOTIFICATIONS.inc(address, n=transfer.notifications)
+            NOTIFICATION_BYTES.inc(address, n=transfer.bytes)
+
+
+class AgeHistory(Govee_Device):
+    # bulk download protocol of the H5174: the ring buffer is addressed by
+    # age in minutes, 0 being the most recent reading
+    __slots__ = ()
+    downloads = True
+    readings_per_row = 6
+    # requests carry ages in minutes as int16, which only reach back over a
+    # ring logged once a minute
+    fixed_log_interval = True
+    download_statuses = {
+        DOWNLOAD_ACCEPTED: (logging.DEBUG, "download accepted", None),
+        DOWNLOAD_COMPLETE: (logging.DEBUG, "download complete", "set"),
+    }
+
+    def range_request(self, first, last):
+        # minutes to ages
+        now = now_minute()
+        tfrom = now - first
+        tto = max(0, now - last)
+        return h5174_request(tfrom, tto), now, f"{tfrom} to {tto}"
+
+    def handler_2012(self, transfer, handle, data):
+        log.debug("VR < handle=%s data=%s", handle, data.hex())
+        data = self.rx_frame(data)
+        self.download_status(transfer, opcode(data), data)
+
+    def decode_rows(self, buf, now):
         # VN < 0x1C2F 02D8 6402 D864 02D8 6402 d864 02d8 6402 d864    index + 6 data readings
-        # unpack 3-byte sections
-        index, = struct.unpack(">h", data[0:2])
-        ts = []
-        for i in range(6):
-            t0, = struct.unpack(">i", bytes([0]) + data[2+i*3:5+i*3])
-            ts.append(t0)
-
-        # ts = self.index_to_ts(index)
-        #if t1 == -1:
-        print(f" {index} --      t0={ts[0]} t1={ts[1]} t2={ts[2]} t3={ts[3]} t4={ts[4]} t5={ts[5]}")
-        # results.append((index + 3, t4 / 100, h4 / 100))
-        # results.append((index + 2, t3 / 100, h3 / 100))
-        # results.append((index + 1, t2 / 100, h2 / 100))
-        # results.append((index + 0, t1 / 100, h1 / 100))
-
-class Govee_H5179(Govee_Device):
-    # device has Wifi, bluetooth,
-    # temperature and humidity
-    @staticmethod
-    def accept(device, advertisement) -> bool:
+        return decode_h5174_rows(buf, now)
+
+
+class IndexHistory(Govee_Device):
+    # bulk download protocol of the H5179: rows addressed by minute index
+    __slots__ = ()
+    downloads = True
+    readings_per_row = 4
+    download_statuses = {
+        0: (logging.DEBUG, "download accepted", None),
+        1: (logging.WARNING, "download request failed (lower bound too low?)", "refuse"),
+        2: (logging.DEBUG, "download finished", "set"),
+    }
+
+    def range_request(self, first, last):
+        return h5179_request(first, last), now_minute(), f"{first} to {last}"
+
+    def handler_2012(self, transfer, handle, data):
+        log.debug("VR < handle=%s data=%s", handle, data.hex())
+        (v,) = STATUS.unpack(data)
+        self.download_status(transfer, v, data)
+
+    def decode_rows(self, buf, now):
+        # VN < E190 A101 280A C210 640A 7C10 960A 6810 640A 5E10
+        return decode_h5179_rows(buf, step=self.log_interval)
+
+
+HISTORY_PROTOCOLS = {"age": AgeHistory, "index": IndexHistory}
+
+
+class Govee_Model(Govee_Device):
+    # a device class built from a govee_models.ModelSpec by model_class()
+    __slots__ = ()
+    spec = None
+
+    @classmethod
+    def accept(cls, device, advertisement) -> bool:
         name = advertisement.local_name
-        return name is not None and name.startswith("Govee_H5179_")
+        return name is not None and name.startswith(cls.name_prefix)
+
+    def advertisement(self, advertisement):
+        return self.decode_advertisement(advertisement.manufacturer_data)
 
     def __repr__(self):
-        return f"Govee H5179 {self.device.address}"
+        return f"Govee {self.spec.model} {self.device.address}"
 
-    # AdvertisementData(local_name='Govee_H5179_E0E2',
-    # manufacturer_data={34817: b'\xec\x00\x01\x01\xea\x06\xd6\x15X'},
-    # service_uuids=['0000180a-0000-1000-8000-00805f9b34fb', '0000fef5-0000-1000-8000-00805f9b34fb', '0000ec88-0000-1000-8000-00805f9b34fb'])
-    def advertisement(self, advertisement):
-        dx = advertisement.manufacturer_data.get(34817, None)
-        if dx:
-            assert dx[0:4].hex() == "ec000101"
-            temp, humid, bat = struct.unpack("<hhb", dx[4:])
-            print(f" {self} temp={temp/100} humid={humid/100} bat={bat}%")
-            self.ads.add(dx)
-            return {"temp": temp / 100, "humid": humid / 100, "bat": bat}
-        return {}
 
-    async def get_meta_from_client(self, client):
-        meta = {}
-        await client.start_notify(
-            self.umisc, functools.partial(self.handler_2011, meta)
-        )
-        await client.write_gatt_char(self.umisc, gv_tx_chk("AA20"))
-        await client.write_gatt_char(self.umisc, gv_tx_chk("AA0D"))
-        await client.write_gatt_char(self.umisc, gv_tx_chk("AA0E"))
-        await asyncio.sleep(0.5)
-        await client.stop_notify(self.umisc)
-        return meta
+def model_class(spec):
+    bases = (Govee_Model,)
+    if spec.bulk is not None:
+        bases = (HISTORY_PROTOCOLS[spec.bulk],) + bases
+    return type(
+        f"Govee_{spec.model}",
+        bases,
+        {
+            "__slots__": (),
+            "spec": spec,
+            "model": spec.model,
+            "name_prefix": spec.name_prefix,
+            "manufacturer_ids": (spec.manufacturer_id,),
+            "decode_advertisement": staticmethod(spec.decode),
+            "meta_requests": spec.meta_requests,
+            "service_uuid": spec.service_uuid,
+            "history_minutes": spec.history_minutes,
+            "buffer_capacity": spec.history_minutes,
+        },
+    )
 
-    async def do_download_from_client(self, client):
-        print(f" {self} connected for download")
-        download_done = asyncio.Event()
-        results = []
-        await client.start_notify(
-            self.ubulk, functools.partial(self.handler_2013, results)
+
+MODEL_CLASSES = {model: model_class(spec) for model, spec in MODELS.items()}
+Govee_H5174 = MODEL_CLASSES["H5174"]
+Govee_H5179 = MODEL_CLASSES["H5179"]
+
+
+def model_classes(models=None):
+    # device classes for the given model names, default all
+    if models is None:
+        return list(MODEL_CLASSES.values())
+    return [MODEL_CLASSES[m.upper()] for m in models]
+
+
+def scan_filter(classes):
+    # service UUIDs for an OS-level scan filter, or None when some class has
+    # no UUID to filter on and would be filtered out
+    uuids = {c.service_uuid for c in classes}
+    if not uuids or None in uuids:
+        return None
+    return sorted(uuids)
+
+
+class CheckerIndex:
+    # Picks candidate checker classes by manufacturer company ID and local
+    # name prefix so only plausible classes have accept() called. Addresses
+    # that matched no candidate at all are remembered in a bounded negative
+    # cache; addresses where a candidate declined are not, as a Govee probe
+    # may advertise before its scan response supplies the name.
+    def __init__(self, checkers, negative_cache=4096):
+        self.checkers = list(checkers)
+        self.by_company = {}
+        self.by_prefix = {}
+        for c in self.checkers:
+            for cid in c.manufacturer_ids:
+                self.by_company.setdefault(cid, []).append(c)
+            if c.name_prefix:
+                self.by_prefix.setdefault(c.name_prefix, []).append(c)
+        self.prefix_lengths = sorted({len(p) for p in self.by_prefix})
+        self.negative_cache = negative_cache
+        self.unmatched = OrderedDict()
+
+    def candidates(self, advertisement):
+        found = []
+        for cid in advertisement.manufacturer_data:
+            for c in self.by_company.get(cid, ()):
+                if c not in found:
+                    found.append(c)
+        name = advertisement.local_name
+        if name:
+            for n in self.prefix_lengths:
+                for c in self.by_prefix.get(name[:n], ()):
+                    if c not in found:
+                        found.append(c)
+        return found
+
+    def match(self, device, advertisement):
+        address = device.address
+        if address in self.unmatched:
+            return None
+        candidates = self.candidates(advertisement)
+        for c in candidates:
+            if c.accept(device, advertisement):
+                return c
+        if not candidates:
+            self.unmatched[address] = True
+            if len(self.unmatched) > self.negative_cache:
+                self.unmatched.popitem(last=False)
+        return None
+
+
+def sink_reading(sink, address, reading):
+    sink.offer((address, now_minute(), reading["temp"], reading["humid"], reading.get("bat"), "adv"))
+
+
+def store_reading(store, kd, minute=None):
+    # probes with no history to download: the store and its rollups get the
+    # latest advertised reading, at most one per minute
+    if minute is None:
+        minute = now_minute()
+    if kd.last_stored == minute or not kd.history:
+        return
+    kd.last_stored = minute
+    reading = kd.history[-1][1]
+    store.series(kd.device.address).append([(minute, reading["temp"], reading["humid"])], bat=reading.get("bat"))
+
+
+def detection_callback(
+    checkers,
+    known_devices,
+    devq,
+    device,
+    advertisement_data,
+    backend=None,
+    sink=None,
+    log_intervals=None,
+    store=None,
+):
+    # checkers: CheckerIndex, known_devices: address -> DeviceFilter,
+    # sink: SinkWriter for advertised readings, log_intervals: minutes
+    # between logged readings keyed by address or model, store: GoveeStore
+    # for probes that only advertise
+    kd = known_devices.get(device.address)
+    if kd is not None:
+        ADVERTISEMENTS.inc(device.address)
+        reading = kd.update(advertisement_data)
+        if reading:
+            if sink is not None:
+                sink_reading(sink, device.address, reading)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("%s temp=%s humid=%s bat=%s%%", kd, reading["temp"], reading["humid"], reading["bat"])
+        if store is not None and not kd.downloads:
+            store_reading(store, kd)
+        return
+
+    c = checkers.match(device, advertisement_data)
+    if c is None:
+        return
+    kd = c(device, advertisement_data, backend)
+    if log_intervals:
+        interval = log_intervals.get(device.address.upper()) or log_intervals.get(kd.model)
+        if interval and kd.fixed_log_interval:
+            log.warning("%s logs every minute, ignoring log interval %s", kd, interval)
+        elif interval:
+            kd.log_interval = interval
+    log.info("Found %s", kd)
+    known_devices[device.address] = kd
+    ADVERTISEMENTS.inc(device.address)
+    reading = kd.update(advertisement_data)
+    if reading:
+        if sink is not None:
+            sink_reading(sink, device.address, reading)
+        log.debug("%s temp=%s humid=%s bat=%s%%", kd, reading["temp"], reading["humid"], reading["bat"])
+    if kd.downloads:
+        devq.put_nowait(kd)
+    elif store is not None:
+        store_reading(store, kd)
+
+
+class StateStore:
+    # per-device high-water mark: the last minute index successfully stored
+    def __init__(self, path):
+        self.path = path
+        self.marks = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.marks = json.load(f)
+
+    def last_index(self, address):
+        return self.marks.get(address)
+
+    def update(self, address, index):
+        prev = self.marks.get(address)
+        if prev is None or index > prev:
+            self.marks[address] = index
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.marks, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class SweepReport:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.durations = {}
+        self.failed = set()
+        self.retries = 0
+
+    def record(self, d, duration, ok):
+        self.durations[d.device.address] = duration
+        if ok:
+            self.failed.discard(d.device.address)
+        else:
+            self.failed.add(d.device.address)
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self):
+        end = self.finished if self.finished is not None else time.monotonic()
+        return end - self.started
+
+    def __str__(self):
+        n = len(self.durations)
+        busy = sum(self.durations.values())
+        return (
+            f"sweep of {n} devices took {self.elapsed:.1f}s "
+            f"(device time {busy:.1f}s, ok={n - len(self.failed)} "
+            f"failed={len(self.failed)} retries={self.retries})"
         )
-        await client.start_notify(
-            self.ureq, functools.partial(self.handler_2012, download_done)
+
+
+class ScanDutyCycle:
+    # Runs the scanner for `window` seconds out of every `interval`:
+    # fast_interval while any known probe has gone `stale_after` seconds
+    # without an advertised reading (or none are known yet), slow_interval
+    # once every probe is fresh. With window >= interval the scanner stays on.
+    def __init__(
+        self,
+        scanner,
+        known_devices,
+        window=10.0,
+        fast_interval=10.0,
+        slow_interval=60.0,
+        stale_after=600.0,
+        clock=time.monotonic,
+    ):
+        self.scanner = scanner
+        self.known_devices = known_devices
+        self.window = window
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.stale_after = stale_after
+        self.clock = clock
+        self.scanning = False
+        self.windows = 0
+        self.scan_seconds = 0.0
+
+    def stale(self):
+        if not self.known_devices:
+            return True
+        now = self.clock()
+        return any(
+            d.last_seen is None or now - d.last_seen > self.stale_after
+            for d in self.known_devices.values()
         )
-        tfrom = 27365606
-        tto = 27366342
-        await client.write_gatt_char(self.ureq, struct.pack("<hII", 0, tfrom, tto))
-        print(f" {self} waiting for bulk data from {tfrom} to {tto}")
-        await download_done.wait()
-        await client.stop_notify(self.ureq)
-        await client.stop_notify(self.ubulk)
-        return results
-
-    def handler_2012(self, finished, handle, data):
-        # print(f"VR < handle={handle} data={data}")
-        (v,) = struct.unpack("<b", data)
-        if v == 2:
-            print("Download finished")
-            finished.set()
-        elif v == 0:
-            print("Download accepted")
-        elif v == 1:
-            print("Download request failed! (lower bound too low?)")
-            finished.set()
-        else:
-            print(f"unknown download status: {data}!")
 
-    def index_to_ts(self, index):
-        return datetime.fromtimestamp(index * 60)
+    def interval(self):
+        return self.fast_interval if self.stale() else self.slow_interval
 
-    def handler_2013(self, results, handle, data):
-        # print(f"VR < handle={handle} data={data}")
-        index, t1, h1, t2, h2, t3, h3, t4, h4 = struct.unpack("<ihhhhhhhh", data)
-        ts = self.index_to_ts(index)
-        if t1 == -1:
-            print(f" {index} {ts} --      t1={t2/100} t2={t3/100} t3={t4/100}")
-            results.append((index + 2, t4 / 100, h4 / 100))
-            results.append((index + 1, t3 / 100, h3 / 100))
-            results.append((index + 0, t2 / 100, h2 / 100))
-        else:
-            print(f" {index} {ts} t1={t1/100} t2={t2/100} t3={t3/100} t4={t4/100}")
-            results.append((index + 3, t4 / 100, h4 / 100))
-            results.append((index + 2, t3 / 100, h3 / 100))
-            results.append((index + 1, t2 / 100, h2 / 100))
-            results.append((index + 0, t1 / 100, h1 / 100))
-
-
-def detection_callback(checkers, known_devices, devq, device, advertisement_data):
-    # print(device.address, "RSSI:", device.rssi, advertisement_data)
-    known_addr = set([kd.device.address for kd in known_devices])
-    for kd in known_devices:
-        if device.address == kd.device.address:
-            kd.advertisement(advertisement_data)
+    async def start(self):
+        if not self.scanning:
+            await self.scanner.start()
+            self.scanning = True
+            self.windows += 1
+
+    async def stop(self):
+        if self.scanning:
+            await self.scanner.stop()
+            self.scanning = False
+
+    async def run(self):
+        try:
+            while True:
+                interval = self.interval()
+                await self.start()
+                await asyncio.sleep(self.window)
+                self.scan_seconds += self.window
+                if self.window < interval:
+                    await self.stop()
+                    log.debug("scanning again in %.0fs", interval - self.window)
+                    await asyncio.sleep(interval - self.window)
+        finally:
+            await self.stop()
+
+
+class DownloadScheduler:
+    # Decides when each device is next downloaded: just before its ring
+    # buffer would wrap past the last stored reading, less `margin` minutes,
+    # and not before. Devices never downloaded are due at once. Accepts new
+    # devices through put_nowait() so it can stand in for the probe queue
+    # given to detection_callback.
+    def __init__(self, state, margin=60, retry_after=600.0, clock=time.time):
+        self.state = state
+        self.margin = margin
+        self.retry_after = retry_after
+        self.clock = clock
+        self.devices = {}
+        self.heap = []
+        self.in_flight = set()
+        self.wake = asyncio.Event()
+        self.seq = 0
+
+    def due(self, d, now=None):
+        if now is None:
+            now = self.clock()
+        last = self.state.last_index(d.device.address) if self.state else None
+        span = d.buffer_capacity * d.log_interval
+        if last is None or not span:
+            return now
+        return max(now, (last + span - self.margin) * 60)
+
+    def schedule(self, d, when):
+        self.seq += 1
+        heapq.heappush(self.heap, (when, self.seq, d.device.address))
+        self.wake.set()
+
+    def put_nowait(self, d):
+        if d.device.address in self.devices:
             return
+        self.devices[d.device.address] = d
+        self.schedule(d, self.due(d))
 
-    for c in checkers:
-        if c.accept(device, advertisement_data):
-            # print(device.address, "RSSI:", device.rssi, advertisement_data)
+    def pop_due(self):
+        now = self.clock()
+        ready = []
+        while self.heap and self.heap[0][0] <= now:
+            _, _, address = heapq.heappop(self.heap)
+            if address not in self.in_flight:
+                self.in_flight.add(address)
+                ready.append(self.devices[address])
+        return ready
 
-            kd = c(device, advertisement_data)
-            print(f" Found {kd}")
-            known_devices.append(kd)
-            kd.advertisement(advertisement_data)
-            devq.put_nowait(kd)
-    # nobody accepted - block future accept() calls?
+    def next_due(self):
+        return self.heap[0][0] if self.heap else None
 
+    def done(self, d, ok):
+        self.in_flight.discard(d.device.address)
+        now = self.clock()
+        when = self.due(d, now) if ok else now
+        if when <= now:
+            # failed, or succeeded without leaving a mark (empty history, a
+            # refused request): do not come straight back
+            when = now + self.retry_after
+        log.info("%s next download at %s", d, datetime.fromtimestamp(when))
+        self.schedule(d, when)
 
-async def main():
-    checkers = [Govee_H5174, Govee_H5179]
-    known_devices = []
+
+async def daemon(
+    concurrency=4,
+    timeout=120.0,
+    retries=2,
+    backoff=2.0,
+    state_path="govee_state.json",
+    store_path="govee_data",
+    margin=60,
+    keep_open=False,
+    poll=60.0,
+    backend=None,
+    metrics_port=None,
+    sinks=(),
+    journal_path=None,
+    models=None,
+    scan_window=None,
+    scan_interval=10.0,
+    slow_scan_interval=60.0,
+    stale_after=600.0,
+    log_intervals=None,
+):
+    # continuous mode: each device is pulled on its own schedule by a
+    # standing pool of probe workers. The scanner never stops unless
+    # scan_window is given, see ScanDutyCycle.
+    backend = backend or default_backend
+    classes = model_classes(models)
+    checkers = CheckerIndex(classes)
+    known_devices = {}
     devq = asyncio.Queue()
+    state = StateStore(state_path)
+    store = GoveeStore(store_path) if store_path else None
+    scheduler = DownloadScheduler(state, margin)
+    journal = Journal(journal_path) if journal_path else None
+    sessions = SessionPool(keep_open=keep_open, journal=journal)
+    sink = SinkWriter(sinks) if sinks else None
+    if sink is not None:
+        await sink.start()
 
-    print("Scanning for devices")
-    scanner = BleakScanner()
-    detection_cb = functools.partial(detection_callback, checkers, known_devices, devq)
+    scanner = backend.scanner(scan_filter(classes))
+    scanner.register_detection_callback(
+        functools.partial(
+            detection_callback,
+            checkers,
+            known_devices,
+            scheduler,
+            backend=backend,
+            sink=sink,
+            log_intervals=log_intervals,
+            store=store,
+        )
+    )
+    duty = None
+    if scan_window is not None:
+        duty = ScanDutyCycle(
+            scanner, known_devices, scan_window, scan_interval, slow_scan_interval, stale_after
+        )
+    workers = asyncio.create_task(
+        probe_devs(
+            devq,
+            state,
+            store,
+            concurrency=concurrency,
+            timeout=timeout,
+            retries=retries,
+            backoff=backoff,
+            sessions=sessions,
+            on_done=scheduler.done,
+            sink=sink,
+        )
+    )
+    server = await metrics.serve(metrics_port) if metrics_port is not None else None
+    if duty is None:
+        log.info("Scanning continuously")
+        await scanner.start()
+        scanning = None
+    else:
+        log.info("Scanning %ss out of every %s-%ss", scan_window, scan_interval, slow_scan_interval)
+        scanning = asyncio.create_task(duty.run())
+    try:
+        while True:
+            for d in scheduler.pop_due():
+                devq.put_nowait(d)
+            scheduler.wake.clear()
+            nxt = scheduler.next_due()
+            delay = poll if nxt is None else min(poll, max(0.0, nxt - scheduler.clock()))
+            try:
+                await asyncio.wait_for(scheduler.wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if scanning is None:
+            await scanner.stop()
+        else:
+            scanning.cancel()
+            await asyncio.gather(scanning, return_exceptions=True)
+        # cancelled probes still flush to the sink and journal on the way out
+        workers.cancel()
+        await asyncio.gather(workers, return_exceptions=True)
+        await sessions.close()
+        if sink is not None:
+            await sink.close()
+        if journal is not None:
+            journal.close()
+        if server is not None:
+            server.close()
+
+
+async def scan(scan_time=10.0, backend=None, sink=None, models=None):
+    # listen only: advertised readings go to sink.offer(), nothing connects
+    backend = backend or default_backend
+    classes = model_classes(models)
+    checkers = CheckerIndex(classes)
+    known_devices = {}
+    scanner = backend.scanner(scan_filter(classes))
+    scanner.register_detection_callback(
+        functools.partial(
+            detection_callback, checkers, known_devices, asyncio.Queue(), backend=backend, sink=sink
+        )
+    )
+    await scanner.start()
+    await asyncio.sleep(scan_time)
+    await scanner.stop()
+    return known_devices
+
+
+async def main(
+    concurrency=4,
+    timeout=120.0,
+    retries=2,
+    backoff=2.0,
+    state_path="govee_state.json",
+    store_path="govee_data",
+    scan_time=10.0,
+    backend=None,
+    metrics_port=None,
+    sinks=(),
+    state=None,
+    journal_path=None,
+    models=None,
+    log_intervals=None,
+):
+    backend = backend or default_backend
+    classes = model_classes(models)
+    checkers = CheckerIndex(classes)
+    known_devices = {}
+    devq = asyncio.Queue()
+    sink = SinkWriter(sinks) if sinks else None
+    if sink is not None:
+        await sink.start()
+
+    server = await metrics.serve(metrics_port) if metrics_port is not None else None
+    log.info("Scanning for devices")
+    scanner = backend.scanner(scan_filter(classes))
+    store = GoveeStore(store_path) if store_path else None
+    detection_cb = functools.partial(
+        detection_callback,
+        checkers,
+        known_devices,
+        devq,
+        backend=backend,
+        sink=sink,
+        log_intervals=log_intervals,
+        store=store,
+    )
     scanner.register_detection_callback(detection_cb)
 
-    t1 = asyncio.create_task(probe_devs(devq))
+    if state is None:
+        state = StateStore(state_path)
+    journal = Journal(journal_path) if journal_path else None
+    sessions = SessionPool(journal=journal)
+    t1 = asyncio.create_task(
+        probe_devs(
+            devq,
+            state,
+            store,
+            concurrency=concurrency,
+            timeout=timeout,
+            retries=retries,
+            backoff=backoff,
+            sessions=sessions,
+            sink=sink,
+        )
+    )
 
     await scanner.start()
-    await asyncio.sleep(10.0)
+    await asyncio.sleep(scan_time)
     await scanner.stop()
 
-    print("Stopped scanning, discovered the following:")
+    log.info("Stopped scanning, discovered the following:")
     for d in scanner.discovered_devices:
-        print(f" {d}")
+        log.info(" %s", d)
 
+    # retries hold their queue slot until requeued, so join() covers them too
+    await devq.join()
     devq.put_nowait(None)
-    await t1
+    report = await t1
+    await sessions.close()
+    if journal is not None:
+        journal.close()
+    if sink is not None:
+        await sink.close()
+    log.info("%s", report)
+    if server is not None:
+        server.close()
+    return report
+
 
+async def probe_dev(d, state=None, store=None, sessions=None, batch_size=512, sink=None):
+    sessions = sessions or SessionPool()
+    session = sessions.session(d)
+    failed = True
+    try:
+        received = await probe_session(d, session, state, store, batch_size, sink)
+        failed = False
+        return received
+    finally:
+        await sessions.release(session, failed)
 
-async def probe_devs(queue):
-    while True:
+
+async def probe_session(d, session, state, store, batch_size, sink=None):
+    log.info("Interogating %s", d)
+    t0 = time.monotonic()
+    md = await session.get_meta()
+    log.info("%s metadata: %s", d, md)
+    await session.set_clock()
+    since = state.last_index(d.device.address) if state else None
+    log.info("Starting download from %s since %s", d, since)
+    series = store.series(d.device.address) if store else None
+    received = 0
+    added = 0
+    newest = None
+    batch = ReadingBatch()
+    progress = DownloadProgress()
+
+    async def flush():
+        nonlocal added
+        if log.isEnabledFor(logging.DEBUG):
+            for r in batch:
+                log.debug("  %s  %s℃  %s%%rh", d.index_to_ts(r[0]), r[1], r[2])
+        rows = batch
+        if series is not None:
+            # sinks only hear about readings the store did not already have
+            rows = series.append(batch)
+            added += len(rows)
+        if sink is not None:
+            address = d.device.address
+            await sink.put_many((address, m, t, h, None, "history") for m, t, h in rows)
+        batch.clear()
+
+    def checkpoint(mark):
+        if state and mark is not None:
+            state.update(d.device.address, mark)
+            state.save()
+
+    try:
+        async for r in session.stream_download(since, progress=progress):
+            received += 1
+            if newest is None or r[0] > newest:
+                newest = r[0]
+            batch.append(r)
+            if len(batch) >= batch_size:
+                await flush()
+    except TransferStalled as e:
+        # keep what arrived and resume after it on the retry
+        await flush()
+        checkpoint(e.resume)
+        log.warning("%s stalled after %d readings, resuming from %s", d, received, e.resume)
+        raise
+    except asyncio.CancelledError:
+        # the per-device deadline: a long first pull still makes progress
+        # from one attempt to the next
+        await flush()
+        checkpoint(progress.resume())
+        log.warning("%s cut off after %d readings, resuming from %s", d, received, progress.resume())
+        raise
+    await flush()
+    elapsed = time.monotonic() - t0
+    DOWNLOAD_SECONDS.observe(elapsed)
+    DOWNLOAD_ROWS.inc(d.device.address, n=received)
+    if received and elapsed > 0:
+        DOWNLOAD_RATE.observe(received / elapsed)
+    if series is not None:
+        log.info("%s stored %d new of %d readings", d, added, received)
+    # rows may come in any order and some may still be missing after the
+    # refetch rounds: the mark only moves past readings with none missing
+    # before them
+    mark = newest
+    if progress.first is not None:
+        mark = progress.resume()
+        if mark == progress.last and newest is not None:
+            mark = max(mark, newest)
+    checkpoint(mark)
+    return received
+
+
+async def probe_devs(
+    queue,
+    state=None,
+    store=None,
+    concurrency=4,
+    timeout=120.0,
+    retries=2,
+    backoff=2.0,
+    sessions=None,
+    on_done=None,
+    sink=None,
+):
+    # Each device gets its own deadline and a failed device goes to the back
+    # of the queue after a backoff, so one hung probe only ever holds a
+    # single slot for at most `timeout` seconds. on_done(d, ok) is called
+    # once a device has succeeded or run out of retries.
+    report = SweepReport()
+    attempts = {}
+    # devices waiting out a backoff, held until requeued
+    backoffs = set()
+    own_sessions = sessions is None
+    if own_sessions:
+        sessions = SessionPool()
+
+    async def requeue(d, delay):
         try:
+            await asyncio.sleep(delay)
+            queue.put_nowait(d)
+        finally:
+            queue.task_done()
+
+    async def worker():
+        while True:
             d = await queue.get()
             if d is None:
+                # wake the next worker, then stop
+                queue.put_nowait(None)
                 return
-            print(f"Interogating {d}")
-            # print(d.ads)
-            md = await d.get_meta()
-            print(f"{d} metadata: {md}")
-            print(f"Starting download from {d}")
-            results = await d.do_download()
-            for r in results:
-                print(f"  {d.index_to_ts(r[0])}  {r[1]}℃  {r[2]}%rh")
+            attempt = attempts.get(d.device.address, 0)
+            t0 = time.monotonic()
+            try:
+                await asyncio.wait_for(probe_dev(d, state, store, sessions, sink=sink), timeout)
+            except Exception as e:
+                report.record(d, time.monotonic() - t0, False)
+                if isinstance(e, asyncio.TimeoutError):
+                    log.warning("%s timed out after %ss", d, timeout)
+                else:
+                    log.exception("%s probe failed", d)
+                if attempt < retries:
+                    attempts[d.device.address] = attempt + 1
+                    report.retries += 1
+                    task = asyncio.create_task(requeue(d, backoff * 2 ** attempt))
+                    backoffs.add(task)
+                    task.add_done_callback(backoffs.discard)
+                    continue
+                ok = False
+            else:
+                report.record(d, time.monotonic() - t0, True)
+                ok = True
+            attempts.pop(d.device.address, None)
+            if on_done is not None:
+                on_done(d, ok)
             queue.task_done()
-        except Exception:
-            logging.exception("ohno")
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*workers)
+    except asyncio.CancelledError:
+        # gather() has cancelled every worker but gives up at the first idle
+        # one; probes in flight must finish checkpointing before this returns
+        await asyncio.gather(*workers, return_exceptions=True)
+        raise
+    finally:
+        for task in list(backoffs):
+            task.cancel()
+        await asyncio.gather(*backoffs, return_exceptions=True)
+        if own_sessions:
+            await sessions.close()
+    report.finish()
+    return report
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    import sys
+
+    from govee_cli import main as cli
+
+    sys.exit(cli(["download"] + sys.argv[1:]))
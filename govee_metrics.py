@@ -0,0 +1,162 @@
+import asyncio
+import bisect
+import logging
+
+# Counters and histograms in the Prometheus text format, with a small HTTP
+# endpoint to scrape them:
+#
+#   curl http://127.0.0.1:9174/metrics
+#
+# Updates are plain dict and list operations so they can sit on the hot
+# paths; label values are positional.
+
+log = logging.getLogger("govee.metrics")
+
+# seconds, from a fast reconnect to a full H5179 history
+TIME_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+RATE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, *labels, n=1):
+        self.values[labels] = self.values.get(labels, 0) + n
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        for labels, v in sorted(self.values.items()):
+            yield f"{self.name}{label_text(self.labels, labels)} {v}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=TIME_BUCKETS, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count], sum
+        self.values = {}
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def count(self, *labels):
+        entry = self.values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        names = self.labels + ("le",)
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for le, c in zip(self.buckets + ("+Inf",), counts):
+                cumulative += c
+                yield f"{self.name}_bucket{label_text(names, labels + (le,))} {cumulative}"
+            lt = label_text(self.labels, labels)
+            yield f"{self.name}_sum{lt} {total}"
+            yield f"{self.name}_count{lt} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, buckets=TIME_BUCKETS, labels=()):
+        return self.add(Histogram(name, help, buckets, labels))
+
+    def render(self):
+        lines = []
+        for m in self.metrics.values():
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.samples())
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # drain the headers, nothing in them matters here
+            while (await reader.readline()).strip():
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.0 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port=9174, host="127.0.0.1"):
+        server = await asyncio.start_server(self.handle, host, port)
+        log.info("metrics on http://%s:%d/metrics", host, server.sockets[0].getsockname()[1])
+        return server
+
+
+metrics = Registry()
+
+ADVERTISEMENTS = metrics.counter(
+    "govee_advertisements_total", "Advertisements received from known devices", ("address",)
+)
+NOTIFICATIONS = metrics.counter(
+    "govee_notifications_total", "Bulk history notifications received", ("address",)
+)
+NOTIFICATION_BYTES = metrics.counter(
+    "govee_notification_bytes_total", "Bulk history bytes received", ("address",)
+)
+CHECKSUM_FAILURES = metrics.counter(
+    "govee_checksum_failures_total", "Frames dropped for a bad XOR checksum", ("address",)
+)
+CONNECT_SECONDS = metrics.histogram("govee_connect_seconds", "Time to establish a connection")
+CONNECT_FAILURES = metrics.counter("govee_connect_failures_total", "Failed connection attempts")
+DOWNLOAD_SECONDS = metrics.histogram(
+    "govee_download_seconds", "Wall time of a device probe, metadata to last row"
+)
+DOWNLOAD_ROWS = metrics.counter(
+    "govee_download_rows_total", "History readings received", ("address",)
+)
+TRANSFER_STALLS = metrics.counter(
+    "govee_transfer_stalls_total", "Bulk transfers abandoned by the inactivity watchdog", ("address",)
+)
+READINGS_SKIPPED = metrics.counter(
+    "govee_readings_skipped_total", "Readings the device did not return when asked again", ("address",)
+)
+DOWNLOAD_RATE = metrics.histogram(
+    "govee_download_rows_per_second", "History readings per second of download", RATE_BUCKETS
+)
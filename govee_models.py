@@ -0,0 +1,136 @@
+import struct
+
+# Supported models as data. Each entry gives how a probe is recognised
+# (local name prefix, manufacturer company ID and the magic bytes opening
+# its manufacturer data), the layout and scaling of the advertised reading,
+# and which xx2013 bulk history format it speaks, if any. ModelSpec compiles
+# the layout into a struct.Struct and a decoder once; govee_logger turns
+# each spec into a device class for CheckerIndex.
+#
+# Advertised layouts, after the magic bytes:
+#
+#   packed   3-byte big-endian temp * 10000 + humid * 10, top bit set for
+#            a negative temperature, then battery %
+#   struct   temp, humid and battery in one struct format, with the divisor
+#            for temp and humid
+#
+# Bulk formats, see govee_codec:
+#
+#   age      H5174 style, rows addressed by age in minutes, six 3-byte
+#            packed readings per row
+#   index    H5179 style, rows addressed by minute index, four int16 pairs
+
+# xx2011 queries every model answers
+VERSIONS = (0xAA0D, 0xAA0E)
+# advertised by the H5174 and H5179 (see the traces in test_govee.py), so
+# scanners can filter on it; left unset for models not yet traced
+GOVEE_SERVICE = "0000ec88-0000-1000-8000-00805f9b34fb"
+
+
+class ModelSpec:
+    def __init__(
+        self,
+        model,
+        name_prefix,
+        manufacturer_id,
+        magic,
+        layout,
+        scale=(1, 1),
+        bulk=None,
+        history_minutes=0,
+        meta_requests=VERSIONS,
+        service_uuid=None,
+    ):
+        self.model = model
+        self.name_prefix = name_prefix
+        self.manufacturer_id = manufacturer_id
+        self.magic = magic
+        self.layout = layout
+        self.scale = scale
+        self.bulk = bulk
+        self.history_minutes = history_minutes
+        self.meta_requests = meta_requests
+        self.service_uuid = service_uuid
+        if layout == "packed":
+            self.struct = struct.Struct(">BHB")
+            self.decode = self.compile_packed()
+        else:
+            self.struct = struct.Struct(layout)
+            self.decode = self.compile_struct()
+
+    def compile_packed(self):
+        mid, magic, offset = self.manufacturer_id, self.magic, len(self.magic)
+        unpack_from = self.struct.unpack_from
+
+        def decode(manufacturer_data):
+            dx = manufacturer_data.get(mid)
+            if dx is None or not dx.startswith(magic):
+                return {}
+            try:
+                hi, lo, bat = unpack_from(dx, offset)
+            except struct.error:
+                return {}
+            if hi & 0x80:
+                v = (hi & 0x7F) << 16 | lo
+                return {"temp": -(v // 1000) / 10, "humid": (v % 1000) / 10, "bat": bat}
+            v = hi << 16 | lo
+            return {"temp": (v // 1000) / 10, "humid": (v % 1000) / 10, "bat": bat}
+
+        return decode
+
+    def compile_struct(self):
+        mid, magic, offset = self.manufacturer_id, self.magic, len(self.magic)
+        unpack_from = self.struct.unpack_from
+        ts, hs = self.scale
+
+        def decode(manufacturer_data):
+            dx = manufacturer_data.get(mid)
+            if dx is None or not dx.startswith(magic):
+                return {}
+            try:
+                t, h, bat = unpack_from(dx, offset)
+            except struct.error:
+                return {}
+            return {"temp": t / ts, "humid": h / hs, "bat": bat}
+
+        return decode
+
+    def __repr__(self):
+        return f"ModelSpec({self.model})"
+
+
+MODELS = {
+    spec.model: spec
+    for spec in (
+        # GVH5174_6BE0 {1: b'\x01\x01\x02\xf7\xd6d', 76: ...}
+        ModelSpec(
+            "H5174",
+            "GVH5174_",
+            1,
+            b"\x01\x01",
+            "packed",
+            bulk="age",
+            history_minutes=10800,
+            service_uuid=GOVEE_SERVICE,
+        ),
+        # H5101/H5102 advertise like the H5174, and keep the same history
+        ModelSpec("H5101", "GVH5101_", 1, b"\x01\x01", "packed", bulk="age", history_minutes=10800),
+        # Govee_H5179_E0E2 {34817: b'\xec\x00\x01\x01\xea\x06\xd6\x15X'}
+        ModelSpec(
+            "H5179",
+            "Govee_H5179_",
+            34817,
+            b"\xec\x00\x01\x01",
+            "<hhb",
+            scale=(100, 100),
+            bulk="index",
+            history_minutes=20 * 24 * 60,
+            meta_requests=(0xAA20,) + VERSIONS,
+            service_uuid=GOVEE_SERVICE,
+        ),
+        # GVH5075_1234 {60552: b'\x00\x03\x1c\x8cd\x00'}
+        ModelSpec("H5075", "GVH5075_", 60552, b"\x00", "packed", bulk="age", history_minutes=20 * 24 * 60),
+        # Govee_H5074_1234 {60552: b'\x00\x0a\x08\x3a\x14\x64\x02'}, no history
+        ModelSpec("H5074", "Govee_H5074_", 60552, b"\x00", "<hHB", scale=(100, 100)),
+    )
+}
@@ -0,0 +1,184 @@
+import bisect
+import os
+import struct
+from array import array
+
+# Precomputed min/max/mean per hour and per day, kept next to a device's
+# columns in the store and updated from the rows each append() adds:
+#
+#   rollup60.bin     one record per hour with readings
+#   rollup1440.bin   one record per day
+#
+# Values stay in the store's scaled integers (x100). Aggregation works a
+# bucket at a time with min()/max()/sum() over array slices rather than a
+# Python loop per reading.
+
+LEVELS = (60, 1440)
+# bucket start, count, temp min/max/sum, humid min/max/sum
+RECORD = struct.Struct("<iihhqhhq")
+COLUMNS = "iihhqhhq"
+
+
+class Rollup:
+    def __init__(self, path, width):
+        self.path = os.path.join(path, f"rollup{width}.bin")
+        self.width = width
+        self.cols = [array(tc) for tc in COLUMNS]
+        # first record not yet written to disk
+        self.dirty_from = None
+        self.exists = os.path.exists(self.path)
+        if self.exists:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            n = len(data) - len(data) % RECORD.size
+            for rec in RECORD.iter_unpack(data[:n]):
+                for col, v in zip(self.cols, rec):
+                    col.append(v)
+
+    def __len__(self):
+        return len(self.cols[0])
+
+    def merge(self, start, count, tmin, tmax, tsum, hmin, hmax, hsum):
+        cols = self.cols
+        pos = bisect.bisect_left(cols[0], start)
+        if pos < len(cols[0]) and cols[0][pos] == start:
+            cols[1][pos] += count
+            cols[2][pos] = min(cols[2][pos], tmin)
+            cols[3][pos] = max(cols[3][pos], tmax)
+            cols[4][pos] += tsum
+            cols[5][pos] = min(cols[5][pos], hmin)
+            cols[6][pos] = max(cols[6][pos], hmax)
+            cols[7][pos] += hsum
+        else:
+            for col, v in zip(cols, (start, count, tmin, tmax, tsum, hmin, hmax, hsum)):
+                col.insert(pos, v)
+        if self.dirty_from is None or pos < self.dirty_from:
+            self.dirty_from = pos
+
+    def add(self, minutes, temps, humids):
+        # minutes sorted and not seen before; temps/humids scaled x100
+        width = self.width
+        i = 0
+        n = len(minutes)
+        while i < n:
+            start = minutes[i] - minutes[i] % width
+            j = bisect.bisect_left(minutes, start + width, i)
+            t = temps[i:j]
+            h = humids[i:j]
+            self.merge(start, j - i, min(t), max(t), sum(t), min(h), max(h), sum(h))
+            i = j
+
+    def save(self):
+        # rewrites from the first changed record on; appends touch only the tail
+        if self.dirty_from is None:
+            return
+        pos = self.dirty_from
+        recs = b"".join(RECORD.pack(*rec) for rec in zip(*(c[pos:] for c in self.cols)))
+        with open(self.path, "r+b" if os.path.exists(self.path) else "wb") as f:
+            f.seek(pos * RECORD.size)
+            f.write(recs)
+            f.truncate()
+        self.exists = True
+        self.dirty_from = None
+
+    def span(self, start, end):
+        # positions of buckets with start <= bucket < end
+        lo = bisect.bisect_left(self.cols[0], start)
+        hi = bisect.bisect_left(self.cols[0], end)
+        return lo, hi
+
+    def rows(self, start=None, end=None):
+        # (bucket minute, count, tmin, tmax, tmean, hmin, hmax, hmean), unscaled
+        lo = 0 if start is None else bisect.bisect_left(self.cols[0], start)
+        hi = len(self) if end is None else bisect.bisect_left(self.cols[0], end)
+        out = []
+        for b, c, tmin, tmax, tsum, hmin, hmax, hsum in zip(*(col[lo:hi] for col in self.cols)):
+            out.append((b, c, tmin / 100, tmax / 100, tsum / c / 100, hmin / 100, hmax / 100, hsum / c / 100))
+        return out
+
+
+class Aggregate:
+    # running count/min/max/sum over scaled values
+    def __init__(self):
+        self.count = 0
+        self.tmin = self.tmax = self.hmin = self.hmax = None
+        self.tsum = self.hsum = 0
+
+    def add(self, count, tmin, tmax, tsum, hmin, hmax, hsum):
+        if not count:
+            return
+        self.count += count
+        self.tmin = tmin if self.tmin is None else min(self.tmin, tmin)
+        self.tmax = tmax if self.tmax is None else max(self.tmax, tmax)
+        self.hmin = hmin if self.hmin is None else min(self.hmin, hmin)
+        self.hmax = hmax if self.hmax is None else max(self.hmax, hmax)
+        self.tsum += tsum
+        self.hsum += hsum
+
+    def add_rollup(self, rollup, lo, hi):
+        if lo >= hi:
+            return
+        c = rollup.cols
+        self.add(
+            sum(c[1][lo:hi]),
+            min(c[2][lo:hi]),
+            max(c[3][lo:hi]),
+            sum(c[4][lo:hi]),
+            min(c[5][lo:hi]),
+            max(c[6][lo:hi]),
+            sum(c[7][lo:hi]),
+        )
+
+    def add_slice(self, s):
+        if len(s):
+            t, h = s.temp, s.humid
+            self.add(len(s), min(t), max(t), sum(t), min(h), max(h), sum(h))
+
+    def result(self):
+        if not self.count:
+            return None
+        return {
+            "count": self.count,
+            "temp_min": self.tmin / 100,
+            "temp_max": self.tmax / 100,
+            "temp_mean": self.tsum / self.count / 100,
+            "humid_min": self.hmin / 100,
+            "humid_max": self.hmax / 100,
+            "humid_mean": self.hsum / self.count / 100,
+        }
+
+
+def aggregate(series, start, end):
+    # min/max/mean over start <= minute < end, or None when there are no
+    # readings. Whole days come from the daily rollup, whole hours around
+    # them from the hourly one, and only the ragged ends read minute rows.
+    acc = Aggregate()
+    levels = sorted(series.rollups, key=lambda r: -r.width)
+
+    def cover(lo, hi, levels):
+        if lo >= hi:
+            return
+        if not levels:
+            acc.add_slice(series.query(lo, hi))
+            return
+        r = levels[0]
+        w = r.width
+        a = -(-lo // w) * w
+        b = hi // w * w
+        if a >= b:
+            cover(lo, hi, levels[1:])
+            return
+        cover(lo, a, levels[1:])
+        acc.add_rollup(r, *r.span(a, b))
+        cover(b, hi, levels[1:])
+
+    cover(start, end, levels)
+    return acc.result()
+
+
+def buckets(series, width, start=None, end=None):
+    # per-bucket rows at one of the maintained widths, for plotting
+    for r in series.rollups:
+        if r.width == width:
+            return r.rows(start, end)
+    raise ValueError(f"Expected one of {[r.width for r in series.rollups]} minute buckets, got {width}")
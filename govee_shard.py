@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import traceback
+import zlib
+
+from govee_logger import StateStore, SweepReport, main
+from govee_sinks import Sink, SinkWriter
+
+# One worker process per HCI adapter. Each worker runs a normal sweep
+# (govee_logger.main) but only sees the devices hashed to its shard, so
+# adapters never compete for a probe and decode work spreads over cores.
+# Workers forward every reading to the coordinator, which writes the merged
+# stream to its sinks and owns the high-water mark file.
+#
+#   asyncio.run(coordinate(["hci0", "hci1"], BleakBackend, sinks=[...]))
+#
+# backend_factory(adapter=name) must be picklable: a class such as
+# BleakBackend, or functools.partial(SimBackend, ...) for testing.
+
+log = logging.getLogger("govee.shard")
+
+
+def shard_of(address, count):
+    # crc32 rather than hash(), which is salted per process; RSSI is not
+    # stable enough to keep a device on one adapter
+    return zlib.crc32(address.upper().encode()) % count
+
+
+class ShardScanner:
+    def __init__(self, scanner, owns):
+        self.scanner = scanner
+        self.owns = owns
+
+    def register_detection_callback(self, callback):
+        owns = self.owns
+
+        def filtered(device, advertisement_data):
+            if owns(device.address):
+                callback(device, advertisement_data)
+
+        self.scanner.register_detection_callback(filtered)
+
+    async def start(self):
+        await self.scanner.start()
+
+    async def stop(self):
+        await self.scanner.stop()
+
+    @property
+    def discovered_devices(self):
+        return [d for d in self.scanner.discovered_devices if self.owns(d.address)]
+
+
+class ShardBackend:
+    # restricts a backend to the addresses of one shard
+    def __init__(self, backend, index, count):
+        self.backend = backend
+        self.index = index
+        self.count = count
+        self.cache = {}
+
+    def owns(self, address):
+        mine = self.cache.get(address)
+        if mine is None:
+            mine = self.cache[address] = shard_of(address, self.count) == self.index
+        return mine
+
+    def scanner(self, service_uuids=None):
+        return ShardScanner(self.backend.scanner(service_uuids), self.owns)
+
+    def client(self, address, timeout=30):
+        return self.backend.client(address, timeout)
+
+
+class QueueSink(Sink):
+    # forwards batches to the coordinator; put() blocks on a full queue,
+    # which backs up into the worker's own SinkWriter
+    name = "shard"
+
+    def __init__(self, q, index):
+        self.q = q
+        self.index = index
+
+    def write(self, rows):
+        self.q.put(("rows", self.index, rows))
+
+
+def shard_main(index, count, adapter, backend_factory, marks, kwargs, q):
+    try:
+        backend = ShardBackend(backend_factory(adapter=adapter), index, count)
+        state = StateStore(None)
+        state.marks = {a: m for a, m in marks.items() if backend.owns(a)}
+        report = asyncio.run(
+            main(backend=backend, state=state, sinks=[QueueSink(q, index)], **kwargs)
+        )
+        q.put(("report", index, (report, state.marks)))
+    except BaseException:
+        q.put(("error", index, traceback.format_exc()))
+
+
+class ShardReport(SweepReport):
+    def __init__(self):
+        super().__init__()
+        self.shards = {}
+        self.rows = 0
+
+    def add(self, index, report):
+        self.shards[index] = report
+        self.durations.update(report.durations)
+        self.failed |= report.failed
+        self.retries += report.retries
+
+    def __str__(self):
+        return f"{super().__str__()} over {len(self.shards)} adapters, {self.rows} rows"
+
+
+async def coordinate(
+    adapters,
+    backend_factory,
+    sinks=(),
+    state_path="govee_state.json",
+    queue_size=64,
+    **kwargs,
+):
+    # kwargs go to govee_logger.main in every worker (concurrency, timeout,
+    # store_path, scan_time, ...); the store may be shared as shards never
+    # hold the same device
+    count = len(adapters)
+    state = StateStore(state_path)
+    ctx = multiprocessing.get_context("spawn")
+    q = ctx.Queue(queue_size)
+    procs = {}
+    for i, adapter in enumerate(adapters):
+        p = ctx.Process(
+            target=shard_main,
+            args=(i, count, adapter, backend_factory, state.marks, kwargs, q),
+            daemon=True,
+        )
+        p.start()
+        procs[i] = p
+
+    writer = SinkWriter(sinks) if sinks else None
+    if writer is not None:
+        await writer.start()
+    report = ShardReport()
+    loop = asyncio.get_running_loop()
+    pending = set(procs)
+    try:
+        while pending:
+            try:
+                kind, index, payload = await loop.run_in_executor(None, q.get, True, 1.0)
+            except queue.Empty:
+                for i in list(pending):
+                    if not procs[i].is_alive():
+                        log.error("shard %d (%s) exited with %s", i, adapters[i], procs[i].exitcode)
+                        pending.discard(i)
+                continue
+            if kind == "rows":
+                report.rows += len(payload)
+                if writer is not None:
+                    await writer.put_many(payload)
+            elif kind == "report":
+                shard_report, marks = payload
+                report.add(index, shard_report)
+                for address, mark in marks.items():
+                    state.update(address, mark)
+                pending.discard(index)
+            else:
+                log.error("shard %d (%s) failed:\n%s", index, adapters[index], payload)
+                pending.discard(index)
+    finally:
+        for p in procs.values():
+            await loop.run_in_executor(None, p.join, 5.0)
+        if writer is not None:
+            await writer.close()
+    state.save()
+    report.finish()
+    log.info("%s", report)
+    return report
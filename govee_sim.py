@@ -0,0 +1,340 @@
+import asyncio
+import math
+import random
+import struct
+import time
+
+from govee_codec import gv_rx_chk, gv_tx_chk
+from govee_logger import now_minute
+
+# In-process stand-in for the BLE stack. SimBackend provides scanner() and
+# client() like govee_logger.BleakBackend, backed by simulated H5174/H5179
+# probes that answer the 2011/2012/2013 characteristics as traced in the
+# README, so scheduling and decoding can be exercised without radios.
+
+UMISC = "494e5445-4c4c-495f-524f-434b535f2011"
+UREQ = "494e5445-4c4c-495f-524f-434b535f2012"
+UBULK = "494e5445-4c4c-495f-524f-434b535f2013"
+
+VERSIONS = {
+    bytes.fromhex("AA0D"): b"1.00.02",
+    bytes.fromhex("AA0E"): b"1.02.00",
+    bytes.fromhex("AA20"): b"1.00.01",
+}
+
+
+class SimDevice:
+    # the BLEDevice fields govee_logger uses
+    def __init__(self, address, name, rssi=-60):
+        self.address = address
+        self.name = name
+        self.rssi = rssi
+
+    def __repr__(self):
+        return f"{self.address}: {self.name}"
+
+
+class SimAdvertisement:
+    # the AdvertisementData fields govee_logger uses
+    def __init__(self, local_name=None, manufacturer_data=None, service_uuids=None):
+        self.local_name = local_name
+        self.manufacturer_data = manufacturer_data or {}
+        self.service_uuids = service_uuids or []
+        self.service_data = {}
+
+
+class SimProbe:
+    def __init__(self, address, sim, seed=0):
+        self.address = address
+        self.sim = sim
+        self.seed = seed
+        self.device = SimDevice(address, self.name())
+        self.downloads = 0
+
+    def name(self):
+        return ""
+
+    def reading(self, minute):
+        # deterministic daily cycle per probe
+        phase = 2 * math.pi * (minute % 1440) / 1440 + self.seed
+        return 20.0 + 5.0 * math.sin(phase), 50.0 + 10.0 * math.cos(phase)
+
+    def advertisement(self):
+        return SimAdvertisement()
+
+    def write(self, client, uuid, data):
+        if uuid == UMISC:
+            data = gv_rx_chk(bytes(data))
+            op = data[0:2]
+            if op in VERSIONS:
+                reply = op + VERSIONS[op]
+            else:
+                # clock set (3310) and anything else just gets acknowledged
+                reply = op
+            client.notify(UMISC, gv_tx_chk(reply))
+        elif uuid == UREQ:
+            self.downloads += 1
+            client.spawn(self.download(client, bytes(data)))
+
+    async def send_rows(self, client, rows):
+        # returns False when the transfer stalled partway, as if the link
+        # had dropped: the rest of the rows and the closing status never come
+        sim = self.sim
+        rng = sim.rng
+        if sim.stall_rate and rows and rng.random() < sim.stall_rate:
+            rows = rows[: rng.randrange(len(rows))]
+            stalled = True
+        else:
+            stalled = False
+        for n, row in enumerate(rows):
+            if sim.drop_rate and rng.random() < sim.drop_rate:
+                continue
+            client.notify(UBULK, row)
+            if n % sim.burst == sim.burst - 1:
+                await asyncio.sleep(sim.burst / sim.notify_rate if sim.notify_rate else 0)
+        return not stalled
+
+
+class SimH5174(SimProbe):
+    def name(self):
+        return "GVH5174_" + self.address.replace(":", "")[-4:]
+
+    def packed(self, minute):
+        t, h = self.reading(minute)
+        return int(t * 10) * 1000 + int(h * 10)
+
+    def advertisement(self):
+        ds = self.packed(now_minute())
+        return SimAdvertisement(
+            local_name=self.device.name,
+            manufacturer_data={
+                1: b"\x01\x01" + ds.to_bytes(3, "big") + b"d",
+                76: b"\x02\x15INTELLI_ROCKS_HWPu\xf2\xff\xc2",
+            },
+            service_uuids=["0000ec88-0000-1000-8000-00805f9b34fb"],
+        )
+
+    def bulk_rows(self, tfrom, tto, now):
+        # index counts down from tfrom; each row holds the reading at age
+        # `index` and the five following (newer) minutes, padded with
+        # 0xFFFFFF past the end of the range
+        rng = self.sim.rng
+        index = tfrom
+        while index >= tto:
+            values = [
+                self.packed(now - (index - i)) if index - i >= tto else 0xFFFFFF
+                for i in range(6)
+            ]
+            step = 6
+            if self.sim.underrun_rate and rng.random() < self.sim.underrun_rate:
+                values[1:] = [0xFFFFFF] * 5
+                step = 1
+            yield struct.pack(">h", index) + b"".join(v.to_bytes(3, "big") for v in values)
+            index -= step
+
+    async def download(self, client, data):
+        data = gv_rx_chk(data)
+        op, tfrom, tto = struct.unpack(">hhh", data[0:6])
+        client.notify(UREQ, gv_tx_chk(data[0:2]))
+        now = now_minute()
+        rows = list(self.bulk_rows(tfrom, tto, now))
+        if await self.send_rows(client, rows):
+            client.notify(UREQ, gv_tx_chk(b"\xee\x01" + struct.pack(">h", len(rows))))
+
+
+class SimH5179(SimProbe):
+    # minutes between logged readings, as set in the app
+    log_interval = 1
+
+    def name(self):
+        return "Govee_H5179_" + self.address.replace(":", "")[-4:]
+
+    def scaled(self, minute):
+        t, h = self.reading(minute)
+        return int(t * 100), int(h * 100)
+
+    def advertisement(self):
+        t, h = self.scaled(now_minute())
+        return SimAdvertisement(
+            local_name=self.device.name,
+            manufacturer_data={34817: bytes.fromhex("ec000101") + struct.pack("<hhb", t, h, 88)},
+            service_uuids=[
+                "0000180a-0000-1000-8000-00805f9b34fb",
+                "0000fef5-0000-1000-8000-00805f9b34fb",
+                "0000ec88-0000-1000-8000-00805f9b34fb",
+            ],
+        )
+
+    def bulk_rows(self, tfrom, tto):
+        # rows of four readings starting at `index`, or three with the first
+        # slot 0xFFFF when the device underruns. Readings are logged on
+        # multiples of the log interval.
+        rng = self.sim.rng
+        interval = self.log_interval
+        index = -(-tfrom // interval) * interval
+        while index <= tto:
+            if self.sim.underrun_rate and rng.random() < self.sim.underrun_rate:
+                values = [(-1, -1)] + [self.scaled(index + i * interval) for i in range(3)]
+                step = 3
+            else:
+                values = [self.scaled(index + i * interval) for i in range(4)]
+                step = 4
+            yield struct.pack("<i", index) + b"".join(struct.pack("<hh", *v) for v in values)
+            index += step * interval
+
+    async def download(self, client, data):
+        _, tfrom, tto = struct.unpack("<hII", data)
+        client.notify(UREQ, b"\x00")
+        if await self.send_rows(client, list(self.bulk_rows(tfrom, tto))):
+            client.notify(UREQ, b"\x02")
+
+
+class SimClient:
+    def __init__(self, sim, address, timeout=30):
+        self.sim = sim
+        self.address = address
+        self.timeout = timeout
+        self.probe = None
+        self.handlers = {}
+        self.tasks = set()
+
+    @property
+    def is_connected(self):
+        return self.probe is not None
+
+    async def connect(self):
+        if self.sim.connect_latency:
+            await asyncio.sleep(self.sim.connect_latency)
+        self.probe = self.sim.probes[self.address]
+        return True
+
+    async def disconnect(self):
+        for t in self.tasks:
+            t.cancel()
+        self.tasks.clear()
+        self.handlers.clear()
+        self.probe = None
+        return True
+
+    async def start_notify(self, uuid, handler):
+        self.handlers[uuid] = handler
+
+    async def stop_notify(self, uuid):
+        self.handlers.pop(uuid, None)
+
+    async def write_gatt_char(self, uuid, data, response=False):
+        if self.probe is None:
+            raise RuntimeError(f"{self.address} not connected")
+        self.probe.write(self, uuid, data)
+
+    def notify(self, uuid, data):
+        self.sim.notifications += 1
+        handler = self.handlers.get(uuid)
+        if handler is not None:
+            handler(0, bytearray(data))
+
+    def spawn(self, coro):
+        t = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(t)
+        t.add_done_callback(self.tasks.discard)
+
+
+class SimScanner:
+    # service_uuids stands in for the OS filter: other advertisements are
+    # counted as on air but never reach the callback
+    def __init__(self, sim, service_uuids=None):
+        self.sim = sim
+        self.service_uuids = set(service_uuids) if service_uuids else None
+        self.callback = None
+        self.task = None
+        self.discovered_devices = []
+        self.seen = set()
+
+    def register_detection_callback(self, callback):
+        self.callback = callback
+
+    async def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def deliver(self, device, ad):
+        self.sim.advertisements += 1
+        if self.service_uuids is not None and self.service_uuids.isdisjoint(ad.service_uuids):
+            return
+        self.sim.delivered += 1
+        if self.callback:
+            self.callback(device, ad)
+
+    async def run(self):
+        seen = self.seen
+        while True:
+            for p in self.sim.probes.values():
+                if p.address not in seen:
+                    seen.add(p.address)
+                    self.discovered_devices.append(p.device)
+                self.deliver(p.device, p.advertisement())
+            for ad in self.sim.noise():
+                self.deliver(*ad)
+            await asyncio.sleep(self.sim.ad_interval)
+
+
+class SimBackend:
+    def __init__(
+        self,
+        h5174=1,
+        h5179=1,
+        others=0,
+        notify_rate=None,
+        burst=32,
+        drop_rate=0.0,
+        underrun_rate=0.0,
+        stall_rate=0.0,
+        ad_interval=1.0,
+        connect_latency=0.0,
+        seed=0,
+        adapter=None,
+    ):
+        # notify_rate: bulk rows/s per device, None for as fast as possible
+        # others: non-Govee devices advertising alongside the probes
+        # stall_rate: share of downloads that go quiet partway through
+        # adapter: accepted like BleakBackend's; every adapter sees every probe
+        self.adapter = adapter
+        self.rng = random.Random(seed)
+        self.notify_rate = notify_rate
+        self.burst = burst
+        self.drop_rate = drop_rate
+        self.underrun_rate = underrun_rate
+        self.stall_rate = stall_rate
+        self.ad_interval = ad_interval
+        self.connect_latency = connect_latency
+        self.probes = {}
+        for i in range(h5174):
+            self.add(SimH5174(f"A4:C1:38:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}", self, i))
+        for i in range(h5179):
+            self.add(SimH5179(f"E3:32:80:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}", self, i))
+        self.others = [
+            SimDevice(f"02:00:00:{i >> 16 & 0xFF:02X}:{i >> 8 & 0xFF:02X}:{i & 0xFF:02X}", None)
+            for i in range(others)
+        ]
+        # advertisements on air, and those handed to the scanner callback
+        self.advertisements = 0
+        self.delivered = 0
+        self.notifications = 0
+        self.started = time.monotonic()
+
+    def add(self, probe):
+        self.probes[probe.address] = probe
+
+    def noise(self):
+        ad = SimAdvertisement(manufacturer_data={76: b"\x10\x05\x01\x18"})
+        return [(d, ad) for d in self.others]
+
+    def scanner(self, service_uuids=None):
+        return SimScanner(self, service_uuids)
+
+    def client(self, address, timeout=30):
+        return SimClient(self, address, timeout)
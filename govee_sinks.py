@@ -0,0 +1,233 @@
+import asyncio
+import concurrent.futures
+import csv
+import logging
+import os
+import socket
+import sqlite3
+import time
+
+from govee_formats import CSV_HEADER, line_protocol
+from govee_metrics import TIME_BUCKETS, metrics
+
+# Output sinks fed through one bounded queue. Rows are tuples
+#
+#   (address, minute index, temp, humid, battery % or None, source)
+#
+# with source "adv" for advertised readings and "history" for downloaded
+# ones. SinkWriter batches them by size and time and hands each batch to the
+# sinks on a single worker thread, so slow storage fills the queue instead of
+# blocking the event loop: downloads wait for space, advertisement callbacks
+# drop and count.
+#
+#   sqlite:govee.db   csv:readings.csv   line:readings.lp
+#   line:tcp://127.0.0.1:8094   line:unix:/run/telegraf.sock
+
+log = logging.getLogger("govee.sinks")
+
+SINK_ROWS = metrics.counter("govee_sink_rows_total", "Rows written by each sink", ("sink",))
+SINK_DROPPED = metrics.counter(
+    "govee_sink_dropped_total", "Advertisement readings dropped on a full sink queue"
+)
+SINK_FLUSH_SECONDS = metrics.histogram(
+    "govee_sink_flush_seconds", "Time to write one batch to every sink", TIME_BUCKETS
+)
+
+
+class Sink:
+    name = "sink"
+
+    def open(self):
+        pass
+
+    def write(self, rows):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteSink(Sink):
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+
+    def open(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS readings ("
+            " address TEXT NOT NULL, minute INTEGER NOT NULL, temp REAL, humid REAL,"
+            " bat INTEGER, source TEXT NOT NULL, PRIMARY KEY (address, minute, source))"
+        )
+        self.db.commit()
+
+    def write(self, rows):
+        # one transaction per batch
+        with self.db:
+            self.db.executemany("INSERT OR IGNORE INTO readings VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+class CSVSink(Sink):
+    name = "csv"
+    header = CSV_HEADER
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def open(self):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.f = open(self.path, "a", newline="")
+        self.writer = csv.writer(self.f)
+        if new:
+            self.writer.writerow(self.header)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.f.flush()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+class LineProtocolSink(Sink):
+    # InfluxDB line protocol with second precision, to a file or a local
+    # stream socket (tcp://host:port or unix:/path)
+    name = "line"
+
+    def __init__(self, target):
+        self.target = target
+        self.f = None
+        self.sock = None
+
+    def open(self):
+        if self.target.startswith("tcp://"):
+            host, port = self.target[6:].rsplit(":", 1)
+            self.sock = socket.create_connection((host, int(port)))
+        elif self.target.startswith("unix:"):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.target[5:])
+        else:
+            self.f = open(self.target, "a")
+
+    def write(self, rows):
+        data = "".join(line_protocol(r) for r in rows)
+        if self.sock is not None:
+            self.sock.sendall(data.encode())
+        else:
+            self.f.write(data)
+            self.f.flush()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+SINKS = {"sqlite": SQLiteSink, "csv": CSVSink, "line": LineProtocolSink}
+
+
+def open_sink(spec):
+    kind, _, target = spec.partition(":")
+    if kind not in SINKS or not target:
+        raise ValueError(f"Expected one of {', '.join(SINKS)} followed by ':target', got {spec!r}")
+    return SINKS[kind](target)
+
+
+class SinkWriter:
+    # Bounded queue in front of the sinks. A batch goes out once batch_size
+    # rows are waiting or flush_interval seconds after its first row.
+    def __init__(self, sinks, maxsize=10000, batch_size=500, flush_interval=1.0):
+        self.sinks = list(sinks)
+        self.queue = asyncio.Queue(maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.task = None
+
+    def offer(self, row):
+        # for callbacks that must not wait: drops the row when full
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            SINK_DROPPED.inc()
+
+    async def put(self, row):
+        await self.queue.put(row)
+
+    async def put_many(self, rows):
+        for r in rows:
+            await self.queue.put(r)
+
+    def write_all(self, batch):
+        t0 = time.monotonic()
+        for s in self.sinks:
+            try:
+                s.write(batch)
+                SINK_ROWS.inc(s.name, n=len(batch))
+            except Exception:
+                log.exception("%s sink failed to write %d rows", s.name, len(batch))
+        SINK_FLUSH_SECONDS.observe(time.monotonic() - t0)
+
+    async def run_in_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def start(self):
+        for s in self.sinks:
+            await self.run_in_thread(s.open)
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self.queue.get()
+            if row is None:
+                break
+            batch = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    row = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        row = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self.run_in_thread(self.write_all, batch)
+
+    async def close(self):
+        # flush whatever is queued, then close the sinks
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+        for s in self.sinks:
+            await self.run_in_thread(s.close)
+        self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
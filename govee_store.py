@@ -0,0 +1,345 @@
+import bisect
+from datetime import datetime
+import mmap
+import os
+import struct
+from array import array
+
+from govee_rollup import LEVELS, Rollup
+
+# Append-only columnar store, one directory per device:
+#
+#   minute.i32   minute index (UNIX timestamp / 60), sorted, unique
+#   temp.i16     temperature * 100
+#   humid.i16    relative humidity * 100
+#   bat.i8       battery %, -1 when unknown (history rows carry none)
+#   blocks.i32   first minute of every BLOCK rows, the sparse index
+#   log.bin      rows older than the last stored minute that were not yet
+#                present, merged back into the columns by compact()
+#   rollup*.bin  hourly and daily aggregates, see govee_rollup
+#
+# Columns are native-endian arrays so they can be mmapped and cast to
+# memoryviews without copying.
+
+BLOCK = 1024
+COLUMNS = (("minute", "i"), ("temp", "h"), ("humid", "h"), ("bat", "b"))
+LOG_ROW = struct.Struct("<ihhb")
+NO_BAT = -1
+
+
+def scale(v):
+    return int(round(v * 100))
+
+
+def file_name(address):
+    return address.replace(":", "").upper()
+
+
+def address_of(name):
+    # inverse of file_name() for MAC addresses
+    return ":".join(name[i : i + 2] for i in range(0, len(name), 2))
+
+
+class ColumnSlice:
+    # views onto a contiguous run of rows, zero-copy when read from the
+    # mmapped columns
+    def __init__(self, minute, temp, humid, bat):
+        self.minute = minute
+        self.temp = temp
+        self.humid = humid
+        self.bat = bat
+
+    def __len__(self):
+        return len(self.minute)
+
+    def __iter__(self):
+        for m, t, h in zip(self.minute, self.temp, self.humid):
+            yield (m, t / 100, h / 100)
+
+
+class ReadingBatch:
+    # readings held as scaled integers in the column types of the store,
+    # about 8 bytes each instead of a tuple and two floats. Iterating gives
+    # (minute, temp, humid) tuples, made only as they are taken; the arrays
+    # themselves support the buffer protocol.
+    __slots__ = ("minute", "temp", "humid")
+
+    def __init__(self, rows=()):
+        self.minute = array("i")
+        self.temp = array("h")
+        self.humid = array("h")
+        self.extend(rows)
+
+    def append(self, row):
+        self.minute.append(row[0])
+        self.temp.append(scale(row[1]))
+        self.humid.append(scale(row[2]))
+
+    def extend(self, rows):
+        if isinstance(rows, ReadingBatch):
+            self.minute.extend(rows.minute)
+            self.temp.extend(rows.temp)
+            self.humid.extend(rows.humid)
+            return
+        for r in rows:
+            self.append(r)
+
+    def clear(self):
+        del self.minute[:], self.temp[:], self.humid[:]
+
+    def __len__(self):
+        return len(self.minute)
+
+    def __getitem__(self, i):
+        return (self.minute[i], self.temp[i] / 100, self.humid[i] / 100)
+
+    def __iter__(self):
+        for m, t, h in zip(self.minute, self.temp, self.humid):
+            yield (m, t / 100, h / 100)
+
+    def __eq__(self, other):
+        if isinstance(other, ReadingBatch):
+            return (self.minute, self.temp, self.humid) == (other.minute, other.temp, other.humid)
+        return list(self) == list(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"ReadingBatch({list(self)!r})"
+
+    def temps(self):
+        return (t / 100 for t in self.temp)
+
+    def humids(self):
+        return (h / 100 for h in self.humid)
+
+    def datetimes(self):
+        return (datetime.fromtimestamp(m * 60) for m in self.minute)
+
+    def columns(self):
+        return memoryview(self.minute), memoryview(self.temp), memoryview(self.humid)
+
+
+class DeviceSeries:
+    def __init__(self, path, auto_compact=10000, rollups=LEVELS):
+        self.path = path
+        self.auto_compact = auto_compact
+        os.makedirs(path, exist_ok=True)
+        self.maps = {}
+        self.views = None
+        self.log = self.read_log()
+        self.blocks = self.read_blocks()
+        self.rollups = self.read_rollups(rollups)
+
+    def read_rollups(self, widths):
+        rollups = [Rollup(self.path, w) for w in widths]
+        missing = [r for r in rollups if not r.exists]
+        if missing and len(self):
+            # rows stored before rollups were kept
+            rows = self.query()
+            for r in missing:
+                r.add(rows.minute, rows.temp, rows.humid)
+                r.save()
+        return rollups
+
+    def column_path(self, name, typecode):
+        return os.path.join(self.path, f"{name}.i{array(typecode).itemsize * 8}")
+
+    def map_columns(self):
+        if self.views is not None:
+            return self.views
+        views = []
+        for name, typecode in COLUMNS:
+            p = self.column_path(name, typecode)
+            if not os.path.exists(p) or os.path.getsize(p) == 0:
+                views.append(memoryview(array(typecode)))
+                continue
+            with open(p, "rb") as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[name] = m
+            views.append(memoryview(m).cast(typecode))
+        self.views = views
+        return views
+
+    def unmap(self):
+        # callers may still hold slices, in which case the old mapping
+        # stays alive until they drop them
+        self.views = None
+        self.maps = {}
+
+    def __len__(self):
+        return len(self.map_columns()[0]) + len(self.log)
+
+    def read_log(self):
+        log = {}
+        p = os.path.join(self.path, "log.bin")
+        if os.path.exists(p):
+            with open(p, "rb") as f:
+                data = f.read()
+            n = len(data) - len(data) % LOG_ROW.size
+            for m, t, h, b in LOG_ROW.iter_unpack(data[:n]):
+                log[m] = (t, h, b)
+        return log
+
+    def read_blocks(self):
+        minutes = self.map_columns()[0]
+        p = os.path.join(self.path, "blocks.i32")
+        blocks = array("i")
+        if os.path.exists(p):
+            with open(p, "rb") as f:
+                blocks.frombytes(f.read())
+        if len(blocks) != (len(minutes) + BLOCK - 1) // BLOCK:
+            blocks = array("i", minutes[::BLOCK].tolist())
+            with open(p, "wb") as f:
+                f.write(blocks.tobytes())
+        return blocks
+
+    def last_index(self):
+        minutes = self.map_columns()[0]
+        last = minutes[-1] if len(minutes) else None
+        if self.log:
+            newest = max(self.log)
+            if last is None or newest > last:
+                last = newest
+        return last
+
+    def find(self, minute):
+        # position of the first stored row >= minute: binary search over the
+        # sparse block index, then within a single block
+        minutes = self.map_columns()[0]
+        b = bisect.bisect_right(self.blocks, minute) - 1
+        if b < 0:
+            return 0
+        lo = b * BLOCK
+        hi = min(lo + BLOCK, len(minutes))
+        return bisect.bisect_left(minutes, minute, lo, hi)
+
+    def contains(self, minute):
+        minutes = self.map_columns()[0]
+        i = self.find(minute)
+        return (i < len(minutes) and minutes[i] == minute) or minute in self.log
+
+    def append(self, rows, bat=None):
+        # idempotent: minutes already stored are skipped. Returns the rows
+        # that were actually added, as a ReadingBatch.
+        b = NO_BAT if bat is None else bat
+        batch = {}
+        if isinstance(rows, ReadingBatch):
+            # already scaled
+            for m, t, h in zip(rows.minute, rows.temp, rows.humid):
+                batch[m] = (t, h, b)
+        else:
+            for r in rows:
+                batch[r[0]] = (scale(r[1]), scale(r[2]), r[3] if len(r) > 3 else b)
+        minutes = self.map_columns()[0]
+        last = minutes[-1] if len(minutes) else None
+
+        tail = []
+        late = []
+        for m in sorted(batch):
+            if last is None or m > last:
+                tail.append(m)
+            elif not self.contains(m):
+                late.append(m)
+
+        if tail:
+            cols = [array(tc) for _, tc in COLUMNS]
+            for m in tail:
+                t, h, bb = batch[m]
+                cols[0].append(m)
+                cols[1].append(t)
+                cols[2].append(h)
+                cols[3].append(bb)
+            n = len(minutes)
+            self.unmap()
+            for (name, tc), col in zip(COLUMNS, cols):
+                with open(self.column_path(name, tc), "ab") as f:
+                    f.write(col.tobytes())
+            # block k starts at row k * BLOCK
+            first = (n + BLOCK - 1) // BLOCK
+            end = (n + len(tail) + BLOCK - 1) // BLOCK
+            new_blocks = array("i", [cols[0][k * BLOCK - n] for k in range(first, end)])
+            self.blocks.extend(new_blocks)
+            with open(os.path.join(self.path, "blocks.i32"), "ab") as f:
+                f.write(new_blocks.tobytes())
+
+        if late:
+            with open(os.path.join(self.path, "log.bin"), "ab") as f:
+                for m in late:
+                    f.write(LOG_ROW.pack(m, *batch[m]))
+                    self.log[m] = batch[m]
+            if len(self.log) >= self.auto_compact:
+                self.compact()
+
+        out = ReadingBatch()
+        out.minute.extend(sorted(tail + late))
+        out.temp.extend(batch[m][0] for m in out.minute)
+        out.humid.extend(batch[m][1] for m in out.minute)
+        if out and self.rollups:
+            for r in self.rollups:
+                r.add(out.minute, out.temp, out.humid)
+                r.save()
+        return out
+
+    def query(self, start=None, end=None):
+        # rows with start <= minute < end
+        minute, temp, humid, bat = self.map_columns()
+        lo = 0 if start is None else self.find(start)
+        hi = len(minute) if end is None else self.find(end)
+        out = ColumnSlice(minute[lo:hi], temp[lo:hi], humid[lo:hi], bat[lo:hi])
+        late = [
+            m for m in self.log if (start is None or m >= start) and (end is None or m < end)
+        ]
+        if not late:
+            return out
+        # unmerged late rows force a copy, compact() restores zero-copy reads
+        merged = {m: (t, h, b) for m, t, h, b in zip(out.minute, out.temp, out.humid, out.bat)}
+        for m in late:
+            merged[m] = self.log[m]
+        cols = [array(tc) for _, tc in COLUMNS]
+        for m in sorted(merged):
+            t, h, b = merged[m]
+            cols[0].append(m)
+            cols[1].append(t)
+            cols[2].append(h)
+            cols[3].append(b)
+        return ColumnSlice(*[memoryview(c) for c in cols])
+
+    def compact(self):
+        if not self.log:
+            return
+        merged = self.query()
+        views = (merged.minute, merged.temp, merged.humid, merged.bat)
+        cols = [array(tc, v.tolist()) for (_, tc), v in zip(COLUMNS, views)]
+        self.unmap()
+        for (name, tc), col in zip(COLUMNS, cols):
+            p = self.column_path(name, tc)
+            with open(p + ".tmp", "wb") as f:
+                f.write(col.tobytes())
+            os.replace(p + ".tmp", p)
+        self.blocks = array("i", cols[0][::BLOCK])
+        with open(os.path.join(self.path, "blocks.i32"), "wb") as f:
+            f.write(self.blocks.tobytes())
+        os.remove(os.path.join(self.path, "log.bin"))
+        self.log = {}
+
+
+class GoveeStore:
+    def __init__(self, root):
+        self.root = root
+        self.series_by_address = {}
+
+    def series(self, address):
+        s = self.series_by_address.get(address)
+        if s is None:
+            s = DeviceSeries(os.path.join(self.root, file_name(address)))
+            self.series_by_address[address] = s
+        return s
+
+    def device_names(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(os.listdir(self.root))
+
+    def addresses(self):
+        return [address_of(n) for n in self.device_names()]
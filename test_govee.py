@@ -1,5 +1,8 @@
+import asyncio
 import pytest
-from govee_logger import stripnull, gv_rx_chk, gv_tx_chk, Govee_H5179, Govee_H5174
+from govee_logger import stripnull, gv_rx_chk, gv_tx_chk, Govee_H5179, Govee_H5174, probe_devs, StateStore
+from govee_logger import decode_h5174_rows, decode_h5179_rows
+from govee_logger import CheckerIndex, detection_callback, now_minute, DownloadScheduler
 from bleak.backends.scanner import AdvertisementData
 from bleak.backends.device import BLEDevice
 
@@ -77,3 +80,356 @@ def test_h5174():
         "humid": 51.8,
         "temp": 19.4,
     }
+
+
+class FakeClient:
+    is_connected = False
+
+    async def connect(self):
+        self.is_connected = True
+
+    async def disconnect(self):
+        self.is_connected = False
+
+
+class FakeBackend:
+    def client(self, address, timeout=30):
+        return FakeClient()
+
+
+class FakeProbe:
+    backend = FakeBackend()
+    meta_requests = ()
+    buffer_capacity = 0
+    log_interval = 1
+
+    def __init__(self, address, delay=0.0, failures=0):
+        self.device = BLEDevice(address=address, name=address)
+        self.delay = delay
+        self.failures = failures
+        self.downloads = 0
+
+    def index_to_ts(self, index):
+        return index
+
+    async def get_meta_from_client(self, client):
+        return {}
+
+    async def set_clock_from_client(self, client, minute=None):
+        return True
+
+    async def stream_download_from_client(self, client, since=None, chunk_rows=64, progress=None):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("link lost")
+        await asyncio.sleep(self.delay)
+        self.downloads += 1
+        yield (1, 20.0, 50.0)
+
+
+async def run_sweep(probes, **kw):
+    q = asyncio.Queue()
+    task = asyncio.create_task(probe_devs(q, **kw))
+    for p in probes:
+        q.put_nowait(p)
+    await q.join()
+    q.put_nowait(None)
+    return await task
+
+
+def test_probe_devs_concurrent():
+    probes = [FakeProbe(f"00:00:00:00:00:{i:02X}", delay=0.05) for i in range(8)]
+    report = asyncio.run(run_sweep(probes, concurrency=8))
+    assert all(p.downloads == 1 for p in probes)
+    assert len(report.durations) == 8 and not report.failed
+    # serial would be 8 * 0.05s
+    assert report.elapsed < 0.3
+
+
+def test_probe_devs_timeout_and_retry():
+    hung = FakeProbe("00:00:00:00:00:01", delay=10.0)
+    flaky = FakeProbe("00:00:00:00:00:02", failures=1)
+    ok = FakeProbe("00:00:00:00:00:03")
+    report = asyncio.run(
+        run_sweep([hung, flaky, ok], concurrency=2, timeout=0.1, retries=1, backoff=0.01)
+    )
+    assert ok.downloads == 1
+    assert flaky.downloads == 1
+    assert hung.downloads == 0
+    assert report.failed == {"00:00:00:00:00:01"}
+    assert report.retries == 2
+
+
+def test_probe_devs_cancel_drops_backoffs():
+    flaky = FakeProbe("00:00:00:00:00:01", failures=1)
+
+    async def run():
+        q = asyncio.Queue()
+        q.put_nowait(flaky)
+        task = asyncio.create_task(probe_devs(q, retries=1, backoff=10.0))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # the device waiting out its backoff went with the sweep
+        return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+
+    assert asyncio.run(run()) == []
+
+
+def test_state_store(tmp_path):
+    path = str(tmp_path / "state.json")
+    state = StateStore(path)
+    assert state.last_index("A4:C1:38:86:6B:E0") is None
+    state.update("A4:C1:38:86:6B:E0", 27366342)
+    state.update("A4:C1:38:86:6B:E0", 27366000)  # never moves backwards
+    state.save()
+    assert StateStore(path).last_index("A4:C1:38:86:6B:E0") == 27366342
+
+
+def test_h5174_bulk_row():
+    device = BLEDevice(address="A4:C1:38:86:6B:E0", name="GVH5174_6BE0")
+    gh5174 = Govee_H5174(device, None)
+    # 20814 t0=185481 then underrun
+    row = bytes.fromhex("514e" + "02d489" + "ffffff" * 5)
+    results = gh5174.decode_rows(row, 27366342)
+    assert results == [(27366342 - 20814, 18.5, 48.1)]
+    row = bytes.fromhex("0006" + "02e2f9" + "02e2fa" * 5)
+    results = gh5174.decode_rows(row, 100)
+    assert [r[0] for r in results] == [94, 95, 96, 97, 98, 99]
+
+
+def test_h5174_bulk_row_below_freezing(tmp_path):
+    from govee_store import GoveeStore
+
+    # -5.0C 80.0%: 50800 with the sign bit, then -0.1C 99.9%
+    row = bytes.fromhex("0002" + "80c670" + "8007cf" + "ffffff" * 4)
+    results = decode_h5174_rows(row, 100)
+    assert results == [(98, -5.0, 80.0), (99, -0.1, 99.9)]
+    series = GoveeStore(str(tmp_path)).series("A4:C1:38:86:6B:E0")
+    assert len(series.append(results)) == 2
+    assert list(series.query().temp) == [-500, -10]
+
+
+def test_bulk_decode_matches_per_packet():
+    device = BLEDevice(address="E3:32:80:C1:E0:E2", name="Govee_H5179_E0E2")
+    gh5179 = Govee_H5179(device, None)
+    rows = [
+        bytes.fromhex("E190A101280AC210640A7C10960A6810640A5E10"),
+        bytes.fromhex("DE90A101FFFFFFFF320AC210F6093A11A609BC11"),
+    ]
+    results = []
+    for row in rows:
+        results.extend(gh5179.decode_rows(row, None))
+    assert decode_h5179_rows(b"".join(rows)) == results
+    assert results[:4] == [
+        (27365604, 26.6, 41.9),
+        (27365603, 27.1, 42.0),
+        (27365602, 26.6, 42.2),
+        (27365601, 26.0, 42.9),
+    ]
+    assert [r[0] for r in results[4:]] == [27365600, 27365599, 27365598]
+
+    device = BLEDevice(address="A4:C1:38:86:6B:E0", name="GVH5174_6BE0")
+    gh5174 = Govee_H5174(device, None)
+    rows = [
+        bytes.fromhex("514e" + "02d489" + "ffffff" * 5),
+        bytes.fromhex("514d" + "02d489" * 3 + "02d09f" * 3),
+    ]
+    results = []
+    for row in rows:
+        results.extend(gh5174.decode_rows(row, 30000))
+    assert decode_h5174_rows(b"".join(rows), 30000) == results
+    assert len(results) == 7
+
+
+def test_detection_dispatch():
+    checkers = CheckerIndex([Govee_H5174, Govee_H5179], negative_cache=2)
+    known = {}
+    q = asyncio.Queue()
+    h5179 = BLEDevice(address="E3:32:80:C1:E0:E2", name="Govee_H5179_E0E2")
+    ad = AdvertisementData(
+        local_name="Govee_H5179_E0E2",
+        manufacturer_data={34817: b"\xec\x00\x01\x01\xea\x06\xd6\x15X"},
+    )
+    assert checkers.candidates(ad) == [Govee_H5179]
+    detection_callback(checkers, known, q, h5179, ad)
+    detection_callback(checkers, known, q, h5179, ad)
+    assert q.qsize() == 1
+    assert isinstance(known["E3:32:80:C1:E0:E2"], Govee_H5179)
+
+    # unrelated devices are cached, up to the limit
+    for i in range(3):
+        other = BLEDevice(address=f"11:22:33:44:55:{i:02X}", name=None)
+        detection_callback(checkers, known, q, other, AdvertisementData(manufacturer_data={76: b"\x02"}))
+    assert list(checkers.unmatched) == ["11:22:33:44:55:01", "11:22:33:44:55:02"]
+
+    # a Govee company ID without the name yet is not blacklisted
+    h5174 = BLEDevice(address="A4:C1:38:86:6B:E0", name=None)
+    detection_callback(checkers, known, q, h5174, AdvertisementData(manufacturer_data={1: b"\x01\x01\x02\xf7\xd6d"}))
+    assert "A4:C1:38:86:6B:E0" not in checkers.unmatched
+    assert q.qsize() == 1
+
+
+def test_detection_log_interval():
+    checkers = CheckerIndex([Govee_H5174, Govee_H5179])
+    known = {}
+    q = asyncio.Queue()
+    intervals = {"H5179": 10, "A4:C1:38:86:6B:E0": 30}
+    h5179 = BLEDevice(address="E3:32:80:C1:E0:E2", name="Govee_H5179_E0E2")
+    ad = AdvertisementData(
+        local_name="Govee_H5179_E0E2",
+        manufacturer_data={34817: b"\xec\x00\x01\x01\xea\x06\xd6\x15X"},
+    )
+    detection_callback(checkers, known, q, h5179, ad, log_intervals=intervals)
+    h5174 = BLEDevice(address="a4:c1:38:86:6b:e0", name="GVH5174_6BE0")
+    ad = AdvertisementData(local_name="GVH5174_6BE0", manufacturer_data={1: b"\x01\x01\x02\xf7\xd6d"})
+    detection_callback(checkers, known, q, h5174, ad, log_intervals=intervals)
+
+    d = known["E3:32:80:C1:E0:E2"]
+    assert d.log_interval == 10
+    first, last = d.download_window(None)
+    assert last - first == d.buffer_capacity * 10
+    assert d.expected_rows(first, last) == d.buffer_capacity // 4 + 1
+    d.range_request(first, last)
+
+    # age-addressed requests only reach back over a once a minute ring
+    h5174 = known["a4:c1:38:86:6b:e0"]
+    assert h5174.log_interval == 1
+    h5174.range_request(*h5174.download_window(None))
+
+
+def test_advertisement_change_driven():
+    device = BLEDevice(address="E3:32:80:C1:E0:E2", name="Govee_H5179_E0E2")
+
+    def ad(payload):
+        return AdvertisementData(local_name="Govee_H5179_E0E2", manufacturer_data={34817: payload})
+
+    a = ad(b"\xec\x00\x01\x01\xea\x06\xd6\x15X")
+    b = ad(b"\xec\x00\x01\x01\xf4\x06b\x16X")
+    gh5179 = Govee_H5179(device, a)
+    gh5179.min_interval = 5.0
+    gh5179.heartbeat = 60.0
+    assert gh5179.update(a, now=0.0)["temp"] == 17.7
+    assert gh5179.update(a, now=1.0) is None  # unchanged
+    assert gh5179.update(b, now=2.0) is None  # rate limited
+    assert gh5179.update(b, now=6.0)["temp"] == 17.8
+    assert gh5179.update(b, now=30.0) is None
+    assert gh5179.update(b, now=66.0)["temp"] == 17.8  # heartbeat
+    assert len(gh5179.history) == 3
+
+
+class FakeH5179Client:
+    def __init__(self, rows):
+        self.rows = rows
+        self.handlers = {}
+        self.writes = []
+
+    async def start_notify(self, uuid, handler):
+        self.handlers[uuid] = handler
+
+    async def stop_notify(self, uuid):
+        del self.handlers[uuid]
+
+    async def write_gatt_char(self, uuid, data):
+        self.writes.append(data)
+        asyncio.get_running_loop().call_soon(self.replay)
+
+    def replay(self):
+        self.handlers[Govee_H5179.ureq](0, b"\x00")
+        for row in self.rows:
+            self.handlers[Govee_H5179.ubulk](0, row)
+        self.handlers[Govee_H5179.ureq](0, b"\x02")
+
+
+def test_stream_download():
+    device = BLEDevice(address="E3:32:80:C1:E0:E2", name="Govee_H5179_E0E2")
+    gh5179 = Govee_H5179(device, None)
+    row = bytes.fromhex("E190A101280AC210640A7C10960A6810640A5E10")
+    client = FakeH5179Client([row] * 100)
+
+    since = now_minute() - 10
+
+    async def consume():
+        chunks = []
+        async for r in gh5179.stream_download_from_client(client, since=since, chunk_rows=16):
+            chunks.append(r)
+        return chunks
+
+    readings = asyncio.run(consume())
+    assert len(readings) == 400
+    assert readings[0] == (27365604, 26.6, 41.9)
+    assert client.handlers == {}
+    assert client.writes[0][:6] == b"\x00\x00" + (since + 1).to_bytes(4, "little")
+
+
+def test_transfer_watchdog():
+    from govee_logger import Transfer, TransferStalled
+
+    async def run(frames, expected):
+        t = Transfer(chunk_rows=4, expected=expected, start_timeout=0.2, idle_min=0.05)
+        for _ in range(frames):
+            t.feed(0, bytes(20))
+        got = 0
+        try:
+            async for chunk in t.chunks():
+                got += len(chunk) // 20
+        except TransferStalled:
+            return got, True
+        return got, False
+
+    # every expected row arrived but the closing status did not
+    assert asyncio.run(run(10, 10)) == (10, False)
+    # the stream went quiet early: the rows so far still come out
+    assert asyncio.run(run(6, 10)) == (6, True)
+    assert asyncio.run(run(0, None)) == (0, True)
+
+
+def test_transfer_end_during_consumer():
+    from govee_logger import Transfer
+
+    async def run():
+        t = Transfer(chunk_rows=4)
+        for _ in range(4):
+            t.feed(0, bytes(20))
+        got = 0
+        async for chunk in t.chunks():
+            if not got:
+                # the rest of the transfer and its end arrive while the
+                # consumer is busy with the first chunk
+                for _ in range(3):
+                    t.feed(0, bytes(20))
+                t.set()
+                await asyncio.sleep(0)
+            got += len(chunk) // 20
+        return got
+
+    assert asyncio.run(run()) == 7
+
+
+def test_download_scheduler(tmp_path):
+    state = StateStore(None)
+    clock = [1000 * 60.0]
+    sched = DownloadScheduler(state, margin=10, clock=lambda: clock[0])
+    fresh = FakeProbe("00:00:00:00:00:01")
+    stored = FakeProbe("00:00:00:00:00:02")
+    stored.buffer_capacity = 100
+    stored.log_interval = 2
+    state.update(stored.device.address, 950)
+
+    sched.put_nowait(fresh)
+    sched.put_nowait(stored)
+    sched.put_nowait(fresh)  # already known
+    assert sched.pop_due() == [fresh]
+    # wraps at minute 950 + 100 * 2, pulled 10 minutes before
+    assert sched.next_due() == 1140 * 60
+
+    clock[0] = 1139 * 60.0
+    assert sched.pop_due() == []
+    clock[0] = 1140 * 60.0
+    assert sched.pop_due() == [stored]
+
+    state.update(stored.device.address, 1140)
+    sched.done(stored, True)
+    assert sched.next_due() == 1330 * 60
+    sched.done(fresh, False)
+    assert sched.next_due() == clock[0] + sched.retry_after
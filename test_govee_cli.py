@@ -0,0 +1,82 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from govee_cli import main, parse_minute, parser
+
+
+def test_download_export_query(tmp_path, capsys):
+    store = str(tmp_path / "data")
+    argv = ["--store", store, "--state", str(tmp_path / "state.json"), "--scan-time", "0.2", "--sim"]
+    assert main(["download"] + argv) == 0
+    capsys.readouterr()
+
+    assert main(["export", "--store", store, "--format", "json", "E3:32:80:00:00:00", "--start=-10m"]) == 0
+    rows = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    minutes = [r["minute"] for r in rows]
+    assert len(rows) >= 10 and minutes == list(range(minutes[0], minutes[0] + len(rows)))
+    assert rows[0]["address"] == "E3:32:80:00:00:00" and rows[0]["bat"] is None
+
+    assert main(["export", "--store", store, "--format", "line"]) == 0
+    out = capsys.readouterr().out
+    assert out.count("address=A4:C1:38:00:00:00") > 10000
+
+    assert main(["query", "--store", store, "--bucket", "1440"]) == 0
+    out = capsys.readouterr().out
+    assert "E3:32:80:00:00:00" in out and "A4:C1:38:00:00:00" in out
+    assert main(["query", "--store", store, "a4:c1:38:00:00:00"]) == 0
+    assert "temp_mean=" in capsys.readouterr().out
+
+
+def test_decode_stays_offline():
+    # decoding captured payloads loads neither asyncio nor bleak
+    code = (
+        "import sys, govee_cli\n"
+        "govee_cli.main(['decode', 'H5179', 'ec000101ea06d61558'])\n"
+        "govee_cli.main(['decode', '--bulk', 'H5179', 'E190A101280AC210640A7C10960A6810640A5E10'])\n"
+        "assert 'asyncio' not in sys.modules and 'bleak' not in sys.modules\n"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, cwd=os.path.dirname(__file__)
+    )
+    assert out.returncode == 0, out.stderr
+    lines = out.stdout.splitlines()
+    assert lines[0] == "ec000101ea06d61558\t{'temp': 17.7, 'humid': 55.9, 'bat': 88}"
+    assert lines[1:] == ["27365604\t26.6\t41.9", "27365603\t27.1\t42.0", "27365602\t26.6\t42.2", "27365601\t26.0\t42.9"]
+
+
+def test_parse_minute():
+    assert parse_minute("27366342") == 27366342
+    assert parse_minute("-1d") == parse_minute("-24h") == parse_minute("-1440m")
+
+
+def test_download_options(capsys):
+    args = parser().parse_args(["download", "--log-interval", "h5179=10", "--log-interval", "e3:32:80:00:00:00=30"])
+    assert dict(args.log_interval) == {"H5179": 10, "E3:32:80:00:00:00": 30}
+    with pytest.raises(SystemExit) as e:
+        parser().parse_args(["download", "--log-interval", "H5179"])
+    assert e.value.code == 2
+    assert "MODEL=MINUTES" in capsys.readouterr().err
+
+    for extra in (["--sim"], ["--daemon"], ["--journal", "j"], ["--metrics-port", "9174"]):
+        with pytest.raises(SystemExit) as e:
+            main(["download", "--adapters", "hci0,hci1"] + extra)
+        assert e.value.code == 2
+        assert f"cannot be combined with {extra[0]}" in capsys.readouterr().err
+    for extra in (
+        ["--scan-window", "5"],
+        ["--scan-interval", "5"],
+        ["--slow-scan-interval", "30"],
+        ["--margin", "0"],
+        ["--keep-open"],
+    ):
+        with pytest.raises(SystemExit) as e:
+            main(["download", "--sim"] + extra)
+        assert e.value.code == 2
+        assert f"{extra[0]} only apply with --daemon" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        main(["download", "--log-interval", "H5174=10"])
+    assert "index-addressed history, not H5174" in capsys.readouterr().err
@@ -0,0 +1,33 @@
+from govee_codec import (
+    REQUESTS,
+    bad_frames,
+    clock_frame,
+    frame_checksums,
+    gv_rx_chk,
+    gv_tx_chk,
+    xor20,
+)
+
+
+def test_xor20():
+    assert xor20(bytes.fromhex("AA0D0000000000000000000000000000000000A7")) == 0
+    assert xor20(bytes.fromhex("AA0D0000000000000000000000000000000000A6")) == 1
+    # 1 ^ 2 ^ ... ^ 20
+    assert xor20(bytes(range(1, 21))) == 20
+
+
+def test_batch_checksums():
+    good = gv_tx_chk("AA0E")
+    bad = good[:-1] + b"\x00"
+    frames = good * 3 + bad + good + bytes(range(1, 21))
+    assert bad_frames(frames) == [3, 5]
+    assert frame_checksums(frames)[3] == good[-1]
+    # a trailing partial frame is ignored
+    assert bad_frames(good + b"\xaa") == []
+
+
+def test_precomputed_frames():
+    assert REQUESTS[0xAA0D] == gv_tx_chk("AA0D")
+    # README trace: WR > 3310 C793 A101 0000 ... 00D7
+    assert clock_frame(0x01A193C7) == bytes.fromhex("3310C793A101" + "00" * 13 + "D7")
+    assert gv_rx_chk(clock_frame(27366342))[:6] == bytes.fromhex("3310C693A101")
@@ -0,0 +1,46 @@
+import asyncio
+
+from govee_metrics import Registry, metrics
+
+
+def test_render():
+    reg = Registry()
+    c = reg.counter("t_total", "things", ("address",))
+    h = reg.histogram("t_seconds", "time", buckets=(1.0, 5.0))
+    c.inc("A")
+    c.inc("A", n=2)
+    h.observe(0.5)
+    h.observe(1.0)
+    h.observe(7.0)
+    text = reg.render()
+    assert '# TYPE t_total counter\nt_total{address="A"} 3\n' in text
+    assert 't_seconds_bucket{le="1.0"} 2\n' in text
+    assert 't_seconds_bucket{le="5.0"} 2\n' in text
+    assert 't_seconds_bucket{le="+Inf"} 3\n' in text
+    assert "t_seconds_count 3\n" in text
+
+
+def test_endpoint_after_sweep(tmp_path):
+    from govee_logger import main
+    from govee_sim import SimBackend
+
+    sim = SimBackend(h5174=1, h5179=1, ad_interval=0.01)
+
+    async def run():
+        server = await metrics.serve(port=0)
+        port = server.sockets[0].getsockname()[1]
+        await main(state_path=None, store_path=None, scan_time=0.05, backend=sim)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+        body = await reader.read()
+        writer.close()
+        server.close()
+        return body.decode()
+
+    text = asyncio.run(run())
+    assert text.startswith("HTTP/1.0 200 OK")
+    for p in sim.probes:
+        assert f'govee_advertisements_total{{address="{p}"}}' in text
+        assert f'govee_notifications_total{{address="{p}"}}' in text
+    assert "govee_connect_seconds_count" in text
+    assert "govee_download_rows_per_second_bucket" in text
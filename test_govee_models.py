@@ -0,0 +1,68 @@
+import asyncio
+
+from govee_logger import MODEL_CLASSES, CheckerIndex, Govee_H5174, detection_callback
+from govee_models import MODELS
+from govee_sim import SimAdvertisement, SimDevice
+
+ADS = {
+    "H5174": ("GVH5174_6BE0", {1: b"\x01\x01\x02\xf7\xd6d"}, {"temp": 19.4, "humid": 51.8, "bat": 100}),
+    "H5101": ("GVH5101_1A2B", {1: b"\x01\x01\x03\x32\x53d"}, {"temp": 20.9, "humid": 49.1, "bat": 100}),
+    "H5179": ("Govee_H5179_E0E2", {34817: b"\xec\x00\x01\x01\xea\x06\xd6\x15X"}, {"temp": 17.7, "humid": 55.9, "bat": 88}),
+    "H5075": ("GVH5075_1234", {60552: b"\x00\x03\x1c\x8cd\x00"}, {"temp": 20.3, "humid": 91.6, "bat": 100}),
+    "H5074": ("Govee_H5074_5678", {60552: b"\x00\x0a\x08\x3a\x14\x64\x02"}, {"temp": 20.58, "humid": 51.78, "bat": 100}),
+}
+
+
+def test_models_decode_and_dispatch():
+    checkers = CheckerIndex(MODEL_CLASSES.values())
+    known = {}
+    q = asyncio.Queue()
+    for i, (model, (name, mdata, reading)) in enumerate(ADS.items()):
+        ad = SimAdvertisement(local_name=name, manufacturer_data=mdata)
+        assert MODELS[model].decode(mdata) == reading
+        device = SimDevice(f"A4:C1:38:00:00:{i:02X}", name)
+        detection_callback(checkers, known, q, device, ad)
+        d = known[device.address]
+        assert type(d) is MODEL_CLASSES[model]
+        assert repr(d) == f"Govee {model} {device.address}"
+    # everything but the H5074 keeps history to download
+    assert q.qsize() == len(ADS) - 1
+    assert not MODEL_CLASSES["H5074"].downloads
+
+
+def test_advertisement_only_model_is_stored(tmp_path):
+    from govee_logger import now_minute, store_reading
+    from govee_rollup import aggregate
+    from govee_store import GoveeStore
+
+    store = GoveeStore(str(tmp_path / "data"))
+    checkers = CheckerIndex(MODEL_CLASSES.values())
+    known = {}
+    q = asyncio.Queue()
+    for model in ("H5074", "H5179"):
+        name, mdata, _ = ADS[model]
+        device = SimDevice(f"A4:C1:38:00:00:{model[-2:]}", name)
+        ad = SimAdvertisement(local_name=name, manufacturer_data=mdata)
+        for _ in range(3):
+            detection_callback(checkers, known, q, device, ad, store=store)
+
+    # one row a minute for the H5074; the H5179 is left to its downloads
+    assert store.addresses() == ["A4:C1:38:00:00:74"]
+    series = store.series("A4:C1:38:00:00:74")
+    q = series.query()
+    assert list(q.minute) == [now_minute()] and list(q.bat) == [100]
+    store_reading(store, known["A4:C1:38:00:00:74"], now_minute() + 1)
+    assert len(series) == 2
+    assert aggregate(series, now_minute() - 60, now_minute() + 60)["temp_mean"] == 20.58
+
+
+def test_packed_negative_and_malformed():
+    spec = MODELS["H5075"]
+    assert spec.decode({60552: b"\x00\x80\x27\x10d\x00"}) == {"temp": -1.0, "humid": 0.0, "bat": 100}
+    # wrong magic, truncated, missing company ID
+    assert spec.decode({60552: b"\x01\x03\x1c\x8cd\x00"}) == {}
+    assert spec.decode({60552: b"\x00\x03"}) == {}
+    assert Govee_H5174.accept(None, SimAdvertisement(local_name="GVH5174_6BE0"))
+    assert Govee_H5174(SimDevice("A4:C1:38:86:6B:E0", "GVH5174_6BE0"), None).advertisement(
+        SimAdvertisement(manufacturer_data={76: b"\x02\x15"})
+    ) == {}
@@ -0,0 +1,51 @@
+import random
+
+from govee_rollup import aggregate, buckets
+from govee_store import GoveeStore
+
+ADDRESS = "A4:C1:38:86:6B:E0"
+
+
+def brute(rows, start, end):
+    sel = [r for r in rows if start <= r[0] < end]
+    t = [round(r[1] * 100) for r in sel]
+    h = [round(r[2] * 100) for r in sel]
+    return len(sel), min(t) / 100, max(t) / 100, sum(t) / len(t) / 100, min(h) / 100, max(h) / 100
+
+
+def test_rollups_match_minute_data(tmp_path):
+    rng = random.Random(3)
+    base = 27366342 - 27366342 % 1440
+    rows = [(base + m, round(rng.uniform(15, 30), 1), round(rng.uniform(30, 70), 1)) for m in range(5 * 1440)]
+    # gaps, then a late backfill of part of them
+    kept = [r for r in rows if not (2000 <= r[0] - base < 2600)]
+    s = GoveeStore(str(tmp_path)).series(ADDRESS)
+    for i in range(0, len(kept), 700):
+        s.append(kept[i : i + 700])
+    s.append(rows[2000:2300])
+    stored = kept + rows[2000:2300]
+
+    # reopened from disk, unaligned ranges crossing days and hours
+    s = GoveeStore(str(tmp_path)).series(ADDRESS)
+    for start, end in [(base + 17, base + 4 * 1440 + 333), (base + 61, base + 119), (base, base + 1440)]:
+        a = aggregate(s, start, end)
+        n, tmin, tmax, tmean, hmin, hmax = brute(stored, start, end)
+        assert a["count"] == n
+        assert (a["temp_min"], a["temp_max"], a["humid_min"], a["humid_max"]) == (tmin, tmax, hmin, hmax)
+        assert abs(a["temp_mean"] - tmean) < 1e-9
+    assert aggregate(s, base - 100, base) is None
+
+    days = buckets(s, 1440)
+    assert [d[0] for d in days] == [base + 1440 * i for i in range(5)]
+    assert days[1][1] == 1440 - 300
+    assert len(buckets(s, 60, base, base + 1440)) == 24
+
+
+def test_rollups_built_for_existing_store(tmp_path):
+    s = GoveeStore(str(tmp_path)).series(ADDRESS)
+    s.append([(m, 20.0 + m % 7, 50.0) for m in range(3000)])
+    for r in s.rollups:
+        (tmp_path / "A4C138866BE0" / f"rollup{r.width}.bin").unlink()
+    s = GoveeStore(str(tmp_path)).series(ADDRESS)
+    assert aggregate(s, 0, 3000)["count"] == 3000
+    assert buckets(s, 1440)[-1][:2] == (2880, 120)
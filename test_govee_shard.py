@@ -0,0 +1,46 @@
+import asyncio
+import functools
+import json
+import sqlite3
+
+from govee_shard import coordinate, shard_of
+from govee_sim import SimBackend
+from govee_sinks import SQLiteSink
+
+
+def test_shard_of_is_stable():
+    addresses = [f"A4:C1:38:00:{i >> 8:02X}:{i & 0xFF:02X}" for i in range(1000)]
+    counts = [0] * 4
+    for a in addresses:
+        counts[shard_of(a, 4)] += 1
+    assert all(200 < c < 300 for c in counts)
+    assert shard_of(addresses[0], 4) == shard_of(addresses[0].lower(), 4)
+
+
+def test_coordinate_merges_shards(tmp_path):
+    factory = functools.partial(SimBackend, h5174=2, h5179=3, ad_interval=0.01)
+    db = str(tmp_path / "govee.db")
+    state_path = str(tmp_path / "state.json")
+    report = asyncio.run(
+        coordinate(
+            ["hci0", "hci1"],
+            factory,
+            sinks=[SQLiteSink(db)],
+            state_path=state_path,
+            store_path=str(tmp_path / "data"),
+            scan_time=0.2,
+        )
+    )
+    addresses = set(factory().probes)
+    assert set(report.durations) == addresses
+    assert not report.failed
+    for i, shard in report.shards.items():
+        assert all(shard_of(a, 2) == i for a in shard.durations)
+
+    con = sqlite3.connect(db)
+    history = dict(
+        con.execute("SELECT address, COUNT(*) FROM readings WHERE source = 'history' GROUP BY address")
+    )
+    assert set(history) == addresses
+    with open(state_path) as f:
+        assert set(json.load(f)) == addresses
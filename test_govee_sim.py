@@ -0,0 +1,396 @@
+import asyncio
+import time
+
+from govee_logger import daemon, main, Govee_H5174, StateStore
+from govee_sim import SimBackend
+from govee_store import GoveeStore
+
+
+def test_sweep_against_simulator(tmp_path):
+    sim = SimBackend(h5174=2, h5179=3, others=50, ad_interval=0.01, underrun_rate=0.01)
+    state_path = str(tmp_path / "state.json")
+    report = asyncio.run(
+        main(state_path=state_path, store_path=str(tmp_path / "data"), scan_time=0.05, backend=sim)
+    )
+    assert len(report.durations) == 5
+    assert not report.failed
+    assert all(p.downloads == 1 for p in sim.probes.values())
+
+    store = GoveeStore(str(tmp_path / "data"))
+    state = StateStore(state_path)
+    for address, probe in sim.probes.items():
+        series = store.series(address)
+        assert series.last_index() == state.last_index(address)
+        if probe.device.name.startswith("GVH5174_"):
+            # a full H5174 ring, less any underrun slots
+            assert 10000 < len(series) <= Govee_H5174.history_minutes + 1
+
+
+def drop_download(sim, refetch_rounds, since):
+    from govee_logger import Govee_H5179
+
+    probe = next(iter(sim.probes.values()))
+    client = sim.client(probe.address)
+
+    async def run():
+        await client.connect()
+        d = Govee_H5179(probe.device, probe.advertisement(), sim)
+        d.refetch_rounds = refetch_rounds
+        rows = [r async for r in d.stream_download_from_client(client, since=since)]
+        await client.disconnect()
+        return rows
+
+    return asyncio.run(run()), probe
+
+
+def test_simulator_drops_rows():
+    from govee_logger import now_minute
+
+    rows, probe = drop_download(SimBackend(h5174=0, h5179=1, drop_rate=0.5, seed=1), 0, now_minute() - 400)
+    assert 0 < len(rows) < 400
+    assert probe.downloads == 1
+
+
+def test_refetch_fills_gaps():
+    from govee_logger import now_minute
+
+    since = now_minute() - 400
+    sim = SimBackend(h5174=0, h5179=1, drop_rate=0.2, seed=1)
+    rows, probe = drop_download(sim, 4, since)
+    minutes = [r[0] for r in rows]
+    assert len(minutes) == len(set(minutes))
+    assert set(range(since + 1, now_minute())) <= set(minutes)
+    # refetches ask only for what went missing, not the whole window again
+    assert probe.downloads > 1
+    assert sim.notifications < 2 * 100 + 20 * probe.downloads
+
+
+def test_holes_hold_the_mark(tmp_path):
+    from govee_logger import Govee_H5179, now_minute, probe_dev
+
+    sim = SimBackend(h5174=0, h5179=1, drop_rate=0.2, seed=1)
+    probe = next(iter(sim.probes.values()))
+    d = Govee_H5179(probe.device, probe.advertisement(), sim)
+    d.refetch_rounds = 0
+    state = StateStore(str(tmp_path / "state.json"))
+    store = GoveeStore(str(tmp_path / "data"))
+    since = now_minute() - 400
+    state.update(probe.address, since)
+
+    asyncio.run(probe_dev(d, state, store))
+    minutes = set(store.series(probe.address).query().minute)
+    mark = StateStore(str(tmp_path / "state.json")).last_index(probe.address)
+    # the mark stops short of the first reading still missing
+    assert set(range(since + 1, mark + 1)) <= minutes
+    assert mark + 1 not in minutes and mark < now_minute() - 1
+
+    # so the next download asks for the missing readings again
+    d.refetch_rounds = 4
+    sim.drop_rate = 0.0
+    asyncio.run(probe_dev(d, state, store))
+    assert set(range(since + 1, now_minute())) <= set(store.series(probe.address).query().minute)
+
+
+def test_unlogged_minutes_do_not_pin_the_mark(tmp_path):
+    from govee_logger import Govee_H5179, now_minute, probe_dev
+    from govee_sim import SimH5179
+
+    hole = now_minute() - 300
+
+    class PowerCycledH5179(SimH5179):
+        # never logged the row holding `hole`
+        def bulk_rows(self, tfrom, tto):
+            for row in super().bulk_rows(tfrom, tto):
+                index = int.from_bytes(row[:4], "little", signed=True)
+                if not index <= hole < index + 4:
+                    yield row
+
+    sim = SimBackend(h5174=0, h5179=0)
+    probe = PowerCycledH5179("E3:32:80:00:00:00", sim)
+    sim.add(probe)
+    d = Govee_H5179(probe.device, probe.advertisement(), sim)
+    state = StateStore(str(tmp_path / "state.json"))
+    store = GoveeStore(str(tmp_path / "data"))
+    state.update(probe.address, hole - 100)
+
+    asyncio.run(probe_dev(d, state, store))
+    # the refetch rounds asked twice more, then the mark moved past the hole
+    assert probe.downloads == 3
+    assert StateStore(str(tmp_path / "state.json")).last_index(probe.address) >= now_minute() - 1
+    assert hole not in set(store.series(probe.address).query().minute)
+
+    # and the next download does not go back for it
+    asyncio.run(probe_dev(d, state, store))
+    assert probe.downloads <= 4
+
+
+def test_log_interval(tmp_path):
+    from govee_logger import Govee_H5179, now_minute, probe_dev
+
+    sim = SimBackend(h5174=0, h5179=1)
+    probe = next(iter(sim.probes.values()))
+    probe.log_interval = 10
+    d = Govee_H5179(probe.device, probe.advertisement(), sim)
+    d.log_interval = 10
+    state = StateStore(str(tmp_path / "state.json"))
+    store = GoveeStore(str(tmp_path / "data"))
+    since = now_minute() - 4000
+    state.update(probe.address, since)
+
+    asyncio.run(probe_dev(d, state, store))
+    # one request, nothing taken for a hole, the mark at the newest reading
+    assert probe.downloads == 1
+    minutes = list(store.series(probe.address).query().minute)
+    assert minutes == list(range(minutes[0], minutes[-1] + 1, 10)) and minutes[0] - since <= 10
+    assert state.last_index(probe.address) >= now_minute() - 10
+
+
+def test_session_reuses_connection():
+    from govee_logger import DeviceSession, Govee_H5179, MetaCache, now_minute
+
+    sim = SimBackend(h5174=0, h5179=1)
+    probe = next(iter(sim.probes.values()))
+    d = Govee_H5179(probe.device, probe.advertisement(), sim)
+
+    cache = MetaCache(ttl=60)
+
+    async def run():
+        async with DeviceSession(d, meta_cache=cache) as session:
+            t0 = time.monotonic()
+            meta = await session.get_meta()
+            # replies arrive immediately, no fixed sleep
+            assert time.monotonic() - t0 < d.meta_deadline / 10
+            assert await session.set_clock()
+            rows = [r async for r in session.stream_download(now_minute() - 100)]
+            return session.connects, meta, rows
+
+    connects, meta, rows = asyncio.run(run())
+    assert connects == 1
+    assert cache.get(probe.address) == meta
+
+    async def cached():
+        async with DeviceSession(d, meta_cache=cache) as session:
+            await session.get_meta()
+            return session.connects
+
+    assert asyncio.run(cached()) == 0
+    assert meta == {"aa20_ver": "1.00.01", "hardware": "1.00.02", "firmware": "1.02.00"}
+    assert len(rows) >= 100
+
+
+def test_daemon_downloads_once_per_buffer(tmp_path):
+    sim = SimBackend(h5174=1, h5179=2, ad_interval=0.01)
+
+    async def run():
+        task = asyncio.create_task(
+            daemon(
+                state_path=str(tmp_path / "state.json"),
+                store_path=str(tmp_path / "data"),
+                backend=sim,
+            )
+        )
+        await asyncio.sleep(1.0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+    # the scanner kept running, but nothing is due again for days
+    assert sim.advertisements > 50
+    assert all(p.downloads == 1 for p in sim.probes.values())
+
+
+def test_daemon_backs_off_refusing_probe(tmp_path):
+    from govee_sim import SimH5179
+
+    class RefusingH5179(SimH5179):
+        # answers every download with status 1, "request failed"
+        async def download(self, client, data):
+            client.notify("494e5445-4c4c-495f-524f-434b535f2012", b"\x01")
+
+    sim = SimBackend(h5174=0, h5179=0, ad_interval=0.01)
+    sim.add(RefusingH5179("E3:32:80:00:00:00", sim))
+
+    async def run():
+        task = asyncio.create_task(
+            daemon(state_path=str(tmp_path / "state.json"), store_path=str(tmp_path / "data"), backend=sim)
+        )
+        await asyncio.sleep(1.0)
+        task.cancel()
+        await asyncio.wait_for(asyncio.gather(task, return_exceptions=True), 5.0)
+
+    asyncio.run(run())
+    # succeeded with nothing to store: no mark, but not due again at once.
+    # The one download halved its window from 20 days down to an hour.
+    assert StateStore(str(tmp_path / "state.json")).last_index("E3:32:80:00:00:00") is None
+    assert [p.downloads for p in sim.probes.values()] == [10]
+
+
+def test_first_download_narrows_refused_range(tmp_path):
+    import struct
+
+    from govee_logger import Govee_H5179, now_minute, probe_dev
+    from govee_sim import SimH5179
+
+    held = 3 * 1440
+
+    class YoungH5179(SimH5179):
+        # refuses lower bounds older than the readings it holds
+        async def download(self, client, data):
+            _, tfrom, _ = struct.unpack("<hII", data)
+            if tfrom < now_minute() - held:
+                client.notify("494e5445-4c4c-495f-524f-434b535f2012", b"\x01")
+            else:
+                await super().download(client, data)
+
+    sim = SimBackend(h5174=0, h5179=0)
+    probe = YoungH5179("E3:32:80:00:00:00", sim)
+    sim.add(probe)
+    d = Govee_H5179(probe.device, probe.advertisement(), sim)
+    state = StateStore(str(tmp_path / "state.json"))
+    store = GoveeStore(str(tmp_path / "data"))
+
+    asyncio.run(probe_dev(d, state, store))
+    # 20 days, 10, 5, then 2.5 days is accepted
+    assert probe.downloads == 4
+    minutes = store.series(probe.address).query().minute
+    assert len(minutes) > 2 * 1440
+    assert state.last_index(probe.address) >= now_minute() - 1
+
+
+def test_daemon_flushes_on_cancel(tmp_path):
+    import csv
+
+    from govee_sinks import open_sink
+
+    sim = SimBackend(h5174=0, h5179=1, notify_rate=500, ad_interval=0.01)
+    csv_path = tmp_path / "rows.csv"
+
+    async def run():
+        task = asyncio.create_task(
+            daemon(
+                state_path=str(tmp_path / "state.json"),
+                store_path=str(tmp_path / "data"),
+                backend=sim,
+                sinks=[open_sink(f"csv:{csv_path}")],
+                journal_path=str(tmp_path / "journal"),
+            )
+        )
+        await asyncio.sleep(1.0)
+        task.cancel()
+        await asyncio.wait_for(asyncio.gather(task, return_exceptions=True), 5.0)
+
+    asyncio.run(run())
+    # cut off mid-download: what reached the store also reached the sink
+    stored = len(GoveeStore(str(tmp_path / "data")).series("E3:32:80:00:00:00"))
+    with open(csv_path) as f:
+        sunk = sum(1 for row in csv.reader(f) if row[-1] == "history")
+    assert 0 < stored == sunk
+    assert StateStore(str(tmp_path / "state.json")).last_index("E3:32:80:00:00:00") is not None
+
+
+def test_stall_resumes(tmp_path):
+    from govee_logger import Govee_H5179, TransferStalled, now_minute, probe_dev
+
+    sim = SimBackend(h5174=0, h5179=1, stall_rate=1.0, notify_rate=2000, burst=8, seed=3)
+    probe = next(iter(sim.probes.values()))
+    d = Govee_H5179(probe.device, probe.advertisement(), sim)
+    d.idle_min = 0.2
+    state = StateStore(str(tmp_path / "state.json"))
+    store = GoveeStore(str(tmp_path / "data"))
+    since = now_minute() - 2000
+    state.update(probe.address, since)
+
+    t0 = time.monotonic()
+    try:
+        asyncio.run(probe_dev(d, state, store))
+    except TransferStalled as e:
+        resume = e.resume
+    else:
+        raise AssertionError("expected a stall")
+    assert time.monotonic() - t0 < 2.0
+    # what arrived is stored and the mark moved up to the first hole
+    assert since < resume == StateStore(str(tmp_path / "state.json")).last_index(probe.address)
+    assert set(range(since + 1, resume + 1)) <= set(store.series(probe.address).query().minute)
+
+    sim.stall_rate = 0.0
+    asyncio.run(probe_dev(d, state, store))
+    assert set(range(since + 1, now_minute())) <= set(store.series(probe.address).query().minute)
+
+
+def test_deadline_checkpoints(tmp_path):
+    from govee_logger import Govee_H5179, now_minute, probe_dev
+
+    sim = SimBackend(h5174=0, h5179=1, notify_rate=200, burst=8, seed=3)
+    probe = next(iter(sim.probes.values()))
+    d = Govee_H5179(probe.device, probe.advertisement(), sim)
+    state = StateStore(str(tmp_path / "state.json"))
+    store = GoveeStore(str(tmp_path / "data"))
+    since = now_minute() - 8000
+    state.update(probe.address, since)
+
+    async def run():
+        try:
+            await asyncio.wait_for(probe_dev(d, state, store), 0.5)
+        except asyncio.TimeoutError:
+            pass
+        else:
+            raise AssertionError("expected the deadline to cut the download off")
+
+    asyncio.run(run())
+    # the next attempt starts after what arrived before the deadline
+    mark = StateStore(str(tmp_path / "state.json")).last_index(probe.address)
+    assert since < mark < now_minute()
+    assert set(range(since + 1, mark + 1)) <= set(store.series(probe.address).query().minute)
+
+
+def test_scan_duty_cycle():
+    import functools
+
+    from govee_logger import CheckerIndex, ScanDutyCycle, detection_callback, model_classes, scan_filter
+
+    classes = model_classes(["H5174", "H5179"])
+    assert scan_filter(classes) == ["0000ec88-0000-1000-8000-00805f9b34fb"]
+    assert scan_filter(model_classes()) is None  # some models are not traced yet
+
+    async def listen(duty_cycled):
+        sim = SimBackend(h5174=1, h5179=1, others=20, ad_interval=0.01)
+        scanner = sim.scanner(scan_filter(classes))
+        known = {}
+        scanner.register_detection_callback(
+            functools.partial(detection_callback, CheckerIndex(classes), known, asyncio.Queue(), backend=sim)
+        )
+        duty = ScanDutyCycle(scanner, known, window=0.05, fast_interval=0.1, slow_interval=0.4)
+        if duty_cycled:
+            task = asyncio.create_task(duty.run())
+        else:
+            await scanner.start()
+        await asyncio.sleep(0.8)
+        stale_before = duty.stale()
+        if duty_cycled:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        else:
+            await scanner.stop()
+        return sim, known, duty, stale_before
+
+    sim, known, duty, stale = asyncio.run(listen(False))
+    # the filter keeps the 20 other devices away from detection_callback
+    assert len(known) == 2 and sim.delivered < sim.advertisements / 5
+    continuous = sim.delivered
+
+    sim, known, duty, stale = asyncio.run(listen(True))
+    # fast while nothing was known, slow once both probes were fresh
+    assert len(known) == 2 and not stale
+    assert 2 <= duty.windows <= 4 and not duty.scanning
+    assert sim.delivered < continuous / 2
+
+    clock = [1000.0]
+    duty = ScanDutyCycle(None, known, stale_after=60.0, clock=lambda: clock[0])
+    for d in known.values():
+        d.last_seen = 990.0
+    assert duty.interval() == duty.slow_interval
+    clock[0] = 1100.0
+    assert duty.interval() == duty.fast_interval
@@ -0,0 +1,80 @@
+import asyncio
+import sqlite3
+import time
+
+from govee_formats import line_protocol
+from govee_sinks import (
+    SINK_DROPPED,
+    CSVSink,
+    LineProtocolSink,
+    SQLiteSink,
+    Sink,
+    SinkWriter,
+    open_sink,
+)
+
+
+def test_line_protocol():
+    row = ("A4:C1:38:00:00:00", 27366342, 21.5, 45.2, 88, "adv")
+    assert line_protocol(row) == (
+        "govee,address=A4:C1:38:00:00:00,source=adv temp=21.5,humid=45.2,bat=88i 1641980520\n"
+    )
+    assert isinstance(open_sink("line:tcp://127.0.0.1:8094"), LineProtocolSink)
+
+
+def test_sweep_into_sinks(tmp_path):
+    from govee_logger import main
+    from govee_sim import SimBackend
+
+    sim = SimBackend(h5174=1, h5179=1, ad_interval=0.01)
+    db = str(tmp_path / "govee.db")
+    sinks = [SQLiteSink(db), CSVSink(str(tmp_path / "r.csv")), LineProtocolSink(str(tmp_path / "r.lp"))]
+    asyncio.run(
+        main(
+            state_path=None,
+            store_path=str(tmp_path / "data"),
+            scan_time=0.05,
+            backend=sim,
+            sinks=sinks,
+        )
+    )
+    con = sqlite3.connect(db)
+    counts = dict(con.execute("SELECT source, COUNT(*) FROM readings GROUP BY source"))
+    assert counts["adv"] >= 2
+    assert counts["history"] > 10000
+    with open(tmp_path / "r.csv") as f:
+        assert sum(1 for _ in f) == sum(counts.values()) + 1
+    with open(tmp_path / "r.lp") as f:
+        assert sum(1 for _ in f) == sum(counts.values())
+
+
+class SlowSink(Sink):
+    def __init__(self):
+        self.batches = []
+
+    def write(self, rows):
+        time.sleep(0.05)
+        self.batches.append(len(rows))
+
+
+def test_backpressure():
+    sink = SlowSink()
+
+    async def run():
+        async with SinkWriter([sink], maxsize=10, batch_size=5, flush_interval=0.01) as w:
+            t0 = time.monotonic()
+            await w.put_many(("A", m, 20.0, 50.0, None, "history") for m in range(50))
+            # put waited for the slow sink to drain the queue
+            waited = time.monotonic() - t0
+            for m in range(100):
+                w.offer(("A", m, 20.0, 50.0, None, "adv"))
+        return waited
+
+    dropped = SINK_DROPPED.get()
+    waited = asyncio.run(run())
+    assert waited > 0.2
+    assert max(sink.batches) <= 5
+    # everything put arrived; offers beyond the queue bound were dropped
+    dropped = SINK_DROPPED.get() - dropped
+    assert dropped > 0
+    assert sum(sink.batches) == 150 - dropped
@@ -0,0 +1,59 @@
+import govee_store
+from govee_store import GoveeStore
+
+
+def test_append_idempotent(tmp_path):
+    store = GoveeStore(str(tmp_path))
+    s = store.series("A4:C1:38:86:6B:E0")
+    rows = [(100 + i, 20.0 + i / 10, 50.0) for i in range(10)]
+    assert len(s.append(rows)) == 10
+    # overlapping re-download only adds the new minutes
+    assert s.append(rows[5:] + [(110, 21.5, 49.9)]) == [(110, 21.5, 49.9)]
+    assert len(s) == 11
+    assert s.last_index() == 110
+
+    q = s.query(103, 106)
+    assert list(q.minute) == [103, 104, 105]
+    assert list(q) == [(103, 20.3, 50.0), (104, 20.4, 50.0), (105, 20.5, 50.0)]
+
+
+def test_backfill_and_compact(tmp_path, monkeypatch):
+    monkeypatch.setattr(govee_store, "BLOCK", 4)
+    s = GoveeStore(str(tmp_path)).series("A4:C1:38:86:6B:E0")
+    s.append([(m, 20.0, 50.0) for m in range(0, 40, 2)])
+    # fill in the odd minutes, some twice
+    assert len(s.append([(m, 21.0, 51.0) for m in range(1, 20, 2)])) == 10
+    assert s.append([(3, 21.0, 51.0)]) == []
+    assert list(s.query(0, 6).minute) == [0, 1, 2, 3, 4, 5]
+
+    s.compact()
+    assert not s.log
+    reopened = GoveeStore(str(tmp_path)).series("A4:C1:38:86:6B:E0")
+    assert len(reopened) == 30
+    assert list(reopened.blocks) == list(reopened.query().minute[::4])
+    q = reopened.query(17, 23)
+    assert list(q.minute) == [17, 18, 19, 20, 22]
+    assert q.temp.obj is not None  # view onto the mapped column
+    assert list(q.temp) == [2100, 2000, 2100, 2000, 2000]
+
+
+def test_reading_batch(tmp_path):
+    from datetime import datetime
+
+    from govee_store import ReadingBatch
+
+    batch = ReadingBatch([(27366342, 21.5, 49.9), (27366341, -3.25, 100.0)])
+    assert len(batch) == 2 and batch[1] == (27366341, -3.25, 100.0)
+    assert list(batch.temps()) == [21.5, -3.25]
+    assert next(batch.datetimes()) == datetime.fromtimestamp(27366342 * 60)
+    minute, temp, humid = batch.columns()
+    assert minute.tobytes() == batch.minute.tobytes() and list(temp) == [2150, -325]
+    del minute, temp, humid  # exported buffers pin the arrays' size
+
+    # stored as given, without scaling again; added rows come back as a batch
+    s = GoveeStore(str(tmp_path)).series("A4:C1:38:86:6B:E0")
+    added = s.append(batch)
+    assert added == [(27366341, -3.25, 100.0), (27366342, 21.5, 49.9)]
+    assert list(s.query().temp) == [-325, 2150]
+    batch.clear()
+    assert not batch and s.append(added) == batch